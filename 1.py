@@ -3,15 +3,10 @@ from bs4 import BeautifulSoup
 import datetime
 import asyncio
 from telegram import Bot
+from sanitizers import escape_markdown_v2
 
 # Telegram Bot 配'
 
-# 转义MarkdownV2中的特殊字符
-def escape_markdown_v2(text):
-    escape_chars = ['_', '*', '[', ']', '(', ')', '~', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in escape_chars:
-        text = text.replace(char, '\\' + char)
-    return text
 
 # 获取上证指数
 def get_shanghai_index():
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+from feed_state import atomic_write_json
+
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.001"))  # 整体误判率上限
+BLOOM_INITIAL_CAPACITY = 10000  # 第一层容量，之后每层翻倍
+BLOOM_TIGHTENING = 0.5  # 每新增一层误判率减半，保证总误判率收敛在上限内
+SENT_URLS_WINDOW = int(os.getenv("SENT_URLS_WINDOW", "5000"))  # 精确保存的最近链接数
+SENT_URLS_BLOOM = os.getenv("SENT_URLS_BLOOM", "1") != "0"  # 设为 0 时退回不限量的精确集合
+
+FILE_HEADER = struct.Struct('<8sdII')  # 魔数、误判率、初始容量、层数
+SLICE_HEADER = struct.Struct('<QQQI4x')  # 位数、已写入数、容量、哈希函数个数
+BLOOM_MAGIC = b'SBLOOM01'
+
+_open_filters = {}  # 同一进程内同一文件只映射一次，避免多个实例各自追加层时互相覆盖
+
+
+class ScalableBloomFilter:
+    """可扩容的 Bloom 过滤器，位数组通过 mmap 直接映射到文件
+
+    打开时不做反序列化，查询和写入只触及相关页面；当前层写满后追加一层
+    容量翻倍、误判率减半的新层，总误判率不超过 error_rate。
+    """
+
+    def __init__(self, file_path, error_rate=BLOOM_ERROR_RATE, initial_capacity=BLOOM_INITIAL_CAPACITY):
+        self.file_path = file_path
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.slices = []  # (位数组偏移, 位数, 容量, 哈希个数, 头部偏移)
+        self._file = None
+        self._map = None
+        self._open()
+
+    def _open(self):
+        new_file = not os.path.exists(self.file_path) or os.path.getsize(self.file_path) < FILE_HEADER.size
+        self._file = open(self.file_path, 'r+b' if not new_file else 'w+b')
+        if new_file:
+            self._file.write(FILE_HEADER.pack(BLOOM_MAGIC, self.error_rate, self.initial_capacity, 0))
+            self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, self.error_rate, self.initial_capacity, slice_count = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != BLOOM_MAGIC:
+            raise ValueError(f"{self.file_path} is not a bloom filter file")
+        offset = FILE_HEADER.size
+        for _ in range(slice_count):
+            num_bits, _, capacity, num_hashes = SLICE_HEADER.unpack_from(self._map, offset)
+            self.slices.append((offset + SLICE_HEADER.size, num_bits, capacity, num_hashes, offset))
+            offset += SLICE_HEADER.size + num_bits // 8
+
+    def _add_slice(self):
+        index = len(self.slices)
+        capacity = self.initial_capacity * (2 ** index)
+        error = self.error_rate * (1 - BLOOM_TIGHTENING) * (BLOOM_TIGHTENING ** index)
+        num_hashes = max(1, math.ceil(math.log2(1 / error)))
+        num_bits = math.ceil(capacity * abs(math.log(error)) / (math.log(2) ** 2))
+        num_bits = (num_bits + 63) // 64 * 64
+
+        offset = len(self._map)
+        self._map.close()
+        self._file.seek(offset)
+        self._file.write(SLICE_HEADER.pack(num_bits, 0, capacity, num_hashes))
+        self._file.truncate(offset + SLICE_HEADER.size + num_bits // 8)
+        self._file.flush()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        FILE_HEADER.pack_into(self._map, 0, BLOOM_MAGIC, self.error_rate, self.initial_capacity, index + 1)
+        self.slices.append((offset + SLICE_HEADER.size, num_bits, capacity, num_hashes, offset))
+
+    @staticmethod
+    def _hashes(key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def _positions(self, hashes, num_bits, num_hashes):
+        h1, h2 = hashes
+        return ((h1 + i * h2) % num_bits for i in range(num_hashes))
+
+    def __contains__(self, key):
+        hashes = self._hashes(key)
+        data = self._map
+        for bits_offset, num_bits, _, num_hashes, _ in self.slices:
+            if all(data[bits_offset + (bit >> 3)] & (1 << (bit & 7))
+                   for bit in self._positions(hashes, num_bits, num_hashes)):
+                return True
+        return False
+
+    def add(self, key):
+        if key in self:
+            return
+        if not self.slices or self._slice_count(self.slices[-1]) >= self.slices[-1][2]:
+            self._add_slice()
+        bits_offset, num_bits, capacity, num_hashes, header_offset = self.slices[-1]
+        for bit in self._positions(self._hashes(key), num_bits, num_hashes):
+            self._map[bits_offset + (bit >> 3)] |= 1 << (bit & 7)
+        num_bits, count, capacity, num_hashes = SLICE_HEADER.unpack_from(self._map, header_offset)
+        SLICE_HEADER.pack_into(self._map, header_offset, num_bits, count + 1, capacity, num_hashes)
+
+    def _slice_count(self, slice_info):
+        return SLICE_HEADER.unpack_from(self._map, slice_info[4])[1]
+
+    def __len__(self):
+        return sum(self._slice_count(slice_info) for slice_info in self.slices)
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_bloom_filter(file_path):
+    key = os.path.abspath(file_path)
+    bloom = _open_filters.get(key)
+    if bloom is None or bloom._map is None:
+        bloom = _open_filters[key] = ScalableBloomFilter(file_path)
+    return bloom
+
+
+class SentUrlHistory:
+    """已发送链接集合：最近 window 条精确保存在 JSON 中，全部历史写入 Bloom 过滤器
+
+    最近的链接（绝大多数查询）由精确集合直接回答；更早的链接只能由 Bloom 过滤器
+    判断，误判时会把一条新视频当作已发送而跳过，概率不超过 BLOOM_ERROR_RATE。
+    首次启用时把旧 JSON 中的全部链接导入过滤器，再把 JSON 截断为最近窗口。
+    use_bloom 为 False 时与原来一样保存不限量的完整集合。
+    """
+
+    def __init__(self, json_path, window=SENT_URLS_WINDOW, use_bloom=SENT_URLS_BLOOM):
+        self.json_path = json_path
+        self.window = window if use_bloom else None
+        self.recent = {}
+        self.bloom = None
+
+        try:
+            if os.path.exists(json_path):
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    self.recent = dict.fromkeys(json.load(f))
+        except Exception as e:
+            logging.error(f"Error loading sent urls from {json_path}: {e}")
+
+        if use_bloom:
+            bloom_path = os.path.splitext(json_path)[0] + '.bloom'
+            migrate = not os.path.exists(bloom_path)
+            try:
+                self.bloom = open_bloom_filter(bloom_path)
+                if migrate:
+                    for url in self.recent:
+                        self.bloom.add(url)
+            except Exception as e:
+                logging.error(f"Error opening bloom filter {bloom_path}, keeping full history: {e}")
+                self.bloom = None
+                self.window = None
+        self._trim()
+
+    def _trim(self):
+        if self.window is None:
+            return
+        excess = len(self.recent) - self.window
+        if excess > 0:
+            for url in list(self.recent)[:excess]:
+                del self.recent[url]
+
+    def __contains__(self, url):
+        if url in self.recent:
+            return True
+        return self.bloom is not None and url in self.bloom
+
+    def __len__(self):
+        return len(self.recent)
+
+    def __iter__(self):
+        return iter(self.recent)
+
+    def add(self, url):
+        self.recent.pop(url, None)
+        self.recent[url] = None
+        if self.bloom is not None:
+            self.bloom.add(url)
+        self._trim()
+
+    def save(self):
+        atomic_write_json(self.json_path, list(self.recent))
+        if self.bloom is not None:
+            self.bloom.flush()
@@ -0,0 +1,150 @@
+import codecs
+import logging
+import re
+import chardet
+
+CHARSET_SAMPLE_BYTES = 16384  # 交给 chardet 的样本上限，从第一个非 ASCII 字节开始截取
+CHARSET_MIN_CONFIDENCE = 0.7
+CHARSET_CACHE_SIZE = 1000  # 按发件人域名缓存的编码条数（每个解析进程各自一份）
+META_SCAN_BYTES = 4096  # <meta charset> 只在开头这段里查找
+
+META_PATTERN = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+NON_ASCII_PATTERN = re.compile(rb'[\x80-\xff]')
+
+# 声明为子集编码时按超集解码，实际混入的 GBK/GB18030 字符不会变成乱码
+SUPERSETS = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'ascii': 'utf-8'}
+
+_sender_charsets = {}
+
+
+def normalize_charset(name):
+    """把声明的编码名规范为 Python 编解码器名，无法识别时返回 None"""
+    if not name:
+        return None
+    if isinstance(name, bytes):
+        name = name.decode('ascii', errors='ignore')
+    try:
+        name = codecs.lookup(name.strip().strip('"\'')).name
+    except LookupError:
+        return None
+    return SUPERSETS.get(name, name)
+
+
+def sniff_meta_charset(content):
+    match = META_PATTERN.search(content[:META_SCAN_BYTES])
+    return normalize_charset(match.group(1)) if match else None
+
+
+def _decodes(content, charset):
+    try:
+        content.decode(charset)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def _remember(sender, charset):
+    if not sender:
+        return
+    _sender_charsets.pop(sender, None)
+    _sender_charsets[sender] = charset
+    if len(_sender_charsets) > CHARSET_CACHE_SIZE:
+        del _sender_charsets[next(iter(_sender_charsets))]
+
+
+def resolve_charset(content, declared=None, sender=None):
+    """按代价从低到高确定正文编码
+
+    1. MIME 声明的 charset，2. HTML 中的 <meta charset>，两者都要能严格解码整段内容；
+    3. 纯 ASCII 直接返回；4. 严格 UTF-8 解码（C 实现，GB/Big5 内容几乎不可能误判）；
+    5. 同一发件人域名上次确定的编码；6. chardet 只检测有限长度的样本。
+    sender 为发件人域名，非 UTF-8 的结果按域名缓存。
+    """
+    candidates = [normalize_charset(declared), sniff_meta_charset(content)]
+    for charset in candidates:
+        if charset and _decodes(content, charset):
+            if charset != 'utf-8':
+                _remember(sender, charset)
+            return charset
+
+    match = NON_ASCII_PATTERN.search(content)
+    if match is None:
+        return 'utf-8'
+    if _decodes(content, 'utf-8'):
+        return 'utf-8'
+
+    cached = _sender_charsets.get(sender)
+    if cached and _decodes(content, cached):
+        return cached
+
+    sample = content[match.start():match.start() + CHARSET_SAMPLE_BYTES]
+    result = chardet.detect(sample)
+    charset = normalize_charset(result.get('encoding'))
+    if charset and result.get('confidence', 0) > CHARSET_MIN_CONFIDENCE:
+        _remember(sender, charset)
+        return charset
+
+    # 都无法确定时相信邮件自己的声明，其次按中文邮件最常见的编码处理
+    fallback = next((charset for charset in candidates if charset), 'gb18030')
+    logging.debug(f"Charset detection uncertain ({result}), using {fallback}")
+    return fallback
+
+
+def _newsletter_corpus():
+    """生成 GB18030 / UTF-8 / Big5 的 HTML 通讯样本：(名称, 原文, 字节, 声明的编码)"""
+    style = '<style>' + ''.join(f'.c{i} {{ margin: {i}px; color: #{i:06x}; }}\n' for i in range(400)) + '</style>'
+    simplified = '本周科技要闻：人工智能模型发布，芯片供应链持续调整，开发者大会即将召开。欢迎订阅我们的每周通讯！'
+    traditional = '本週科技要聞：人工智慧模型發佈，晶片供應鏈持續調整，開發者大會即將召開。歡迎訂閱我們的每週通訊！'
+    corpus = []
+    for name, text, encoding in [
+        ('GB18030', simplified, 'gb18030'),
+        ('UTF-8', simplified, 'utf-8'),
+        ('Big5', traditional, 'big5'),
+    ]:
+        for paragraphs in (20, 400):
+            body = ''.join(f'<p class="c{i % 400}">{text} 第{i}期</p>\n' for i in range(paragraphs))
+            for variant, declared, meta in [('declared', encoding, ''),
+                                            ('meta', None, f'<meta charset="{encoding}">'),
+                                            ('none', None, '')]:
+                html = f'<html><head>{meta}{style}</head><body>{body}</body></html>'
+                corpus.append((f'{name} {paragraphs}p {variant}', html, html.encode(encoding), declared))
+    return corpus
+
+
+def _legacy_detect(content):
+    """mail.py 原来的实现：对整段内容运行 chardet"""
+    result = chardet.detect(content)
+    if result['confidence'] > 0.7:
+        return result['encoding']
+    return 'gb18030' if b'\x80' in content[:100] else 'utf-8'
+
+
+if __name__ == "__main__":
+    # 基准测试：python3 charsets.py
+    import time
+
+    assert normalize_charset('GB2312') == 'gb18030'
+    assert normalize_charset('"UTF-8"') == 'utf-8'
+    assert normalize_charset('x-unknown') is None
+    assert sniff_meta_charset(b'<meta http-equiv="Content-Type" content="text/html; charset=big5">') == 'big5'
+    # 声明错误时不采用声明
+    assert resolve_charset('本周科技要闻：人工智能模型发布'.encode('utf-8'), declared='gb2312') == 'utf-8'
+
+    for name, html, content, declared in _newsletter_corpus():
+        _sender_charsets.clear()
+        start = time.perf_counter()
+        legacy = _legacy_detect(content)
+        legacy_time = time.perf_counter() - start
+        legacy_ok = content.decode(legacy or 'utf-8', errors='replace') == html
+
+        start = time.perf_counter()
+        charset = resolve_charset(content, declared, sender='news.example.com')
+        first_time = time.perf_counter() - start
+        start = time.perf_counter()
+        resolve_charset(content, declared, sender='news.example.com')
+        cached_time = time.perf_counter() - start
+        assert content.decode(charset) == html, (name, charset)
+
+        print(f"{name:24} {len(content) / 1024:6.0f} KiB  legacy {legacy_time * 1000:8.2f} ms "
+              f"({legacy}{'' if legacy_ok else ', garbled'})  tiered {first_time * 1000:6.2f} ms, "
+              f"cached {cached_time * 1000:5.2f} ms ({charset})")
@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import signal
+import time
+
+# 轮询间隔（秒）：新源从默认值开始，有更新时缩短，连续无更新时逐步拉长
+FEED_MIN_INTERVAL = int(os.getenv("FEED_MIN_INTERVAL", "120"))
+FEED_MAX_INTERVAL = int(os.getenv("FEED_MAX_INTERVAL", "3600"))
+FEED_DEFAULT_INTERVAL = int(os.getenv("FEED_DEFAULT_INTERVAL", "600"))
+SPEEDUP_FACTOR = 0.5  # 本次有新条目时间隔乘以该系数
+BACKOFF_FACTOR = 1.5  # 本次无新条目时间隔乘以该系数
+INTERVAL_JITTER = 0.1  # 随机抖动比例，避免所有源在同一时刻扎堆请求
+SCHEDULER_CONCURRENCY = 10
+
+
+class FeedScheduler:
+    """常驻进程中按各源更新频率自适应轮询
+
+    以 (下次到期时间, 序号, 源) 维护一个小顶堆，始终只等待最早到期的源。
+    任务返回本次的新条目数（或新条目列表），据此调整该源的轮询间隔；
+    传入 feed_state 时间隔随条件请求缓存一起持久化，重启后沿用。
+    save_hook 为无参协程函数，任务有新条目时在保存 feed_state 之前调用（例如写回已发送记录），
+    保证已发送记录先于校验信息落盘。
+    """
+
+    def __init__(self, feed_state=None, min_interval=FEED_MIN_INTERVAL, max_interval=FEED_MAX_INTERVAL,
+                 default_interval=FEED_DEFAULT_INTERVAL, concurrency=SCHEDULER_CONCURRENCY, save_hook=None):
+        self.feed_state = feed_state
+        self.save_hook = save_hook
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queue = []
+        self.jobs = {}
+        self.intervals = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.running = set()
+
+    def add(self, key, job, delay=0):
+        """注册一个源，job 为无参协程函数"""
+        self.jobs[key] = job
+        self.intervals[key] = self._load_interval(key)
+        self._push(key, delay)
+
+    def _load_interval(self, key):
+        if self.feed_state is not None:
+            interval = self.feed_state.states.get(key, {}).get('poll_interval')
+            if interval:
+                return self._clamp(interval)
+        return self._clamp(self.default_interval)
+
+    def _clamp(self, interval):
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _push(self, key, delay):
+        heapq.heappush(self.queue, (time.monotonic() + delay, next(self.counter), key))
+        self.wakeup.set()
+
+    def next_interval(self, key, new_items):
+        interval = self.intervals[key] * (SPEEDUP_FACTOR if new_items else BACKOFF_FACTOR)
+        interval = self._clamp(interval)
+        self.intervals[key] = interval
+        if self.feed_state is not None:
+            self.feed_state.states.setdefault(key, {})['poll_interval'] = interval
+            self.feed_state.dirty = True
+        return interval
+
+    async def _run(self, key):
+        new_items = 0
+        try:
+            async with self.semaphore:
+                result = await self.jobs[key]()
+            new_items = result if isinstance(result, int) else len(result or [])
+        except Exception as e:
+            logging.error(f"Scheduled job failed for {key}: {e}")
+        interval = self.next_interval(key, new_items)
+        logging.info(f"{key}: {new_items} new items, next poll in {interval:.0f}s")
+        if new_items and self.save_hook is not None:
+            try:
+                await self.save_hook()
+            except Exception as e:
+                logging.error(f"Save hook failed after {key}: {e}")
+        if self.feed_state is not None:
+            self.feed_state.save()
+        self._push(key, interval * random.uniform(1 - INTERVAL_JITTER, 1 + INTERVAL_JITTER))
+
+    def stop(self):
+        """让 run_forever 正常返回，调用方的 finally 照常保存状态"""
+        self.stopping = True
+        self.wakeup.set()
+
+    async def run_forever(self):
+        """循环调度直到 stop()（SIGTERM 时自动调用）或被取消（Ctrl+C）"""
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+        try:
+            while not self.stopping:
+                self.wakeup.clear()
+                if not self.queue:
+                    await self.wakeup.wait()
+                    continue
+                due, _, key = self.queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self.queue)
+                task = asyncio.create_task(self._run(key))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except (NotImplementedError, RuntimeError):
+                pass
+            for task in list(self.running):
+                task.cancel()
+            if self.running:
+                await asyncio.gather(*self.running, return_exceptions=True)
@@ -0,0 +1,196 @@
+import calendar
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+# YouTube 等源每次请求都会变化的字段（播放量、评分），计算内容哈希时忽略
+VOLATILE_PATTERN = re.compile(rb'<media:(?:statistics|starRating)\b[^>]*/>')
+EARLY_STOP_AFTER = 3  # 连续遇到多少条已知或过期条目后停止遍历（容忍置顶等少量乱序）
+
+
+def atomic_write_json(file_path, data, **dump_kwargs):
+    """先写临时文件再原子替换，避免写到一半时进程退出导致文件损坏"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def content_hash(content):
+    return hashlib.blake2b(VOLATILE_PATTERN.sub(b'', content), digest_size=16).hexdigest()
+
+
+class FeedState:
+    """按订阅源 URL 持久化 ETag / Last-Modified / 内容哈希及高水位（最新条目）
+
+    新响应的校验信息先暂存，调用方处理成功后 commit() 才生效；处理或发送失败时
+    下次请求仍会拿到完整内容并重试。
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.states = {}
+        self.pending = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.file_path):
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    self.states = json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading feed state from {self.file_path}: {e}")
+            self.states = {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            atomic_write_json(self.file_path, self.states)
+            self.dirty = False
+        except Exception as e:
+            logging.error(f"Error saving feed state to {self.file_path}: {e}")
+
+    def conditional_headers(self, feed_url):
+        state = self.states.get(feed_url, {})
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return headers
+
+    def is_unchanged(self, feed_url, digest):
+        return self.states.get(feed_url, {}).get('hash') == digest
+
+    def update(self, feed_url, response_headers, digest):
+        self.pending[feed_url] = (response_headers.get('ETag'), response_headers.get('Last-Modified'), digest)
+
+    def commit(self, feed_url):
+        """订阅源本次内容处理成功后调用，保存暂存的校验信息"""
+        validators = self.pending.pop(feed_url, None)
+        if validators is None:
+            return
+        state = self.states.setdefault(feed_url, {})
+        state['etag'], state['last_modified'], state['hash'] = validators
+        self.dirty = True
+
+    def high_water_mark(self, feed_url):
+        """已确认处理的最新条目 (GUID, 时间戳)"""
+        state = self.states.get(feed_url, {})
+        return state.get('hwm_guid'), state.get('hwm_timestamp')
+
+    def is_caught_up(self, feed_url):
+        """上一轮产出的条目是否都已确认处理，且遍历没有被调用方中途截断"""
+        state = self.states.get(feed_url, {})
+        return not state.get('pending') and not state.get('truncated')
+
+    def start_pass(self, feed_url):
+        state = self.states.setdefault(feed_url, {})
+        for key in ('pending', 'truncated'):
+            if state.pop(key, None):
+                self.dirty = True
+
+    def add_pending(self, feed_url, guid):
+        self.states.setdefault(feed_url, {}).setdefault('pending', []).append(guid)
+        self.dirty = True
+
+    def mark_truncated(self, feed_url):
+        self.states.setdefault(feed_url, {})['truncated'] = True
+        self.dirty = True
+
+    def mark_processed(self, feed_url, entry):
+        """调用方确认条目已处理（发送成功或按规则跳过）后调用，只在此时推进高水位"""
+        state = self.states.setdefault(feed_url, {})
+        guid = entry_guid(entry)
+        timestamp = entry_timestamp(entry)
+        pending = state.get('pending')
+        if pending and guid in pending:
+            pending.remove(guid)
+            self.dirty = True
+        hwm_timestamp = state.get('hwm_timestamp')
+        if state.get('hwm_guid') is None or (timestamp is not None and (hwm_timestamp is None or timestamp > hwm_timestamp)):
+            state['hwm_guid'] = guid
+            state['hwm_timestamp'] = timestamp
+            self.dirty = True
+
+def entry_guid(entry):
+    return entry.get('id') or entry.get('link')
+
+
+def entry_timestamp(entry):
+    for field in ('published_parsed', 'updated_parsed', 'created_parsed'):
+        value = entry.get(field)
+        if value:
+            return calendar.timegm(value)
+    return None
+
+
+def iter_new_entries(entries, feed_url, feed_state, is_known, stop_after=EARLY_STOP_AFTER):
+    """按时间倒序遍历条目，只产出 is_known 判定为未处理的条目
+
+    上一轮产出的条目都已经 feed_state.mark_processed 确认、且遍历没有被调用方
+    中途截断时，遇到已知的高水位条目或连续 stop_after 条已知条目即停止，其余
+    条目不再检查；否则完整遍历，让上次因数量上限被截断或发送失败的条目得到重试。
+    调用方提前结束遍历时应关闭生成器（contextlib.closing），截断状态才会立即记录。
+    """
+    caught_up = feed_state.is_caught_up(feed_url)
+    hwm_guid, _ = feed_state.high_water_mark(feed_url)
+    feed_state.start_pass(feed_url)
+    known_run = 0
+
+    try:
+        for entry in entries:
+            if is_known(entry):
+                known_run += 1
+                guid = entry_guid(entry)
+                if caught_up and (known_run >= stop_after or (guid is not None and guid == hwm_guid)):
+                    break
+                continue
+            known_run = 0
+            guid = entry_guid(entry)
+            if guid is not None:
+                feed_state.add_pending(feed_url, guid)
+            yield entry
+    except GeneratorExit:
+        # 调用方提前结束（如达到每源条目上限），之后的条目下一轮仍需检查
+        feed_state.mark_truncated(feed_url)
+        raise
+
+async def fetch_if_changed(session, feed_url, feed_state, headers=None, **kwargs):
+    """条件请求订阅源：304 或内容哈希未变化时返回 None，否则返回响应内容
+
+    返回内容时新的校验信息只是暂存，调用方处理成功后需调用 feed_state.commit(feed_url)。
+    网络错误和非 2xx 状态码照常抛出，由调用方按原有逻辑处理。
+    """
+    request_headers = dict(headers or {})
+    request_headers.update(feed_state.conditional_headers(feed_url))
+
+    async with session.get(feed_url, headers=request_headers, **kwargs) as response:
+        if response.status == 304:
+            logging.info(f"Feed not modified (304): {feed_url}")
+            return None
+        response.raise_for_status()
+        content = await response.read()
+        response_headers = response.headers
+
+    digest = content_hash(content)
+    feed_state.update(feed_url, response_headers, digest)
+    if feed_state.is_unchanged(feed_url, digest):
+        # 与上次成功处理的内容相同，新的 ETag / Last-Modified 可以直接保存
+        feed_state.commit(feed_url)
+        logging.info(f"Feed content unchanged: {feed_url}")
+        return None
+    return content
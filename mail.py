@@ -1,5 +1,6 @@
 import imaplib
 import email
+import json
 from email.header import decode_header
 import html2text
 import telegram
@@ -7,9 +8,18 @@ import logging
 import os
 import asyncio
 import re
-import chardet
+import select
+import ssl
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 from email.utils import parseaddr
+from telegram_sender import send_queue
+from message_chunker import split_message
+from charsets import resolve_charset
 
 load_dotenv()
 
@@ -20,6 +30,17 @@ EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_API_KEY")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 MAX_MESSAGE_LENGTH = 3800
+IMAP_FETCH_BATCH = int(os.getenv("IMAP_FETCH_BATCH", "50"))  # 每条 UID FETCH 取回的邮件数
+IMAP_IDLE_TIMEOUT = int(os.getenv("IMAP_IDLE_TIMEOUT", "540"))  # 单次 IDLE 最长秒数，RFC 2177 要求不超过 29 分钟
+IMAP_POLL_INTERVAL = int(os.getenv("IMAP_POLL_INTERVAL", "60"))  # 服务器不支持 IDLE 时的 NOOP 轮询间隔
+IMAP_RECONNECT_MIN = 5  # 断线重连的初始等待秒数，失败后翻倍
+IMAP_RECONNECT_MAX = 300
+IMAP_LOGOUT_TIMEOUT = 5
+IMAP_PARTIAL_FETCH = os.getenv("IMAP_PARTIAL_FETCH", "true").lower() == "true"  # 按 BODYSTRUCTURE 只取正文部分
+MAIL_PIPELINE_DEPTH = int(os.getenv("MAIL_PIPELINE_DEPTH", "8"))  # 已取回但尚未发送的邮件上限
+MAIL_PARSE_WORKERS = int(os.getenv("MAIL_PARSE_WORKERS", str(os.cpu_count() or 1)))  # 解析邮件的进程数
+MAIL_MAX_RENDER_ATTEMPTS = int(os.getenv("MAIL_MAX_RENDER_ATTEMPTS", "3"))  # 同一封邮件解析失败多少次后放弃并标记为已读
+MAIL_FAILURES_FILE = "mail_failures.json"  # 各 UID 的解析失败次数，cron 单轮模式下跨进程累计
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
 
 # 日志配置
@@ -51,13 +72,10 @@ class EmailDecoder:
             return str(header)
 
     @staticmethod
-    def detect_encoding(content):
-        """编码检测优化"""
+    def detect_encoding(content, declared=None, sender=None):
+        """编码检测：声明的 charset → <meta charset> → UTF-8 → 发件人域名缓存 → chardet 采样"""
         try:
-            result = chardet.detect(content)
-            if result['confidence'] > 0.7:
-                return result['encoding']
-            return 'gb18030' if b'\x80' in content[:100] else 'utf-8'
+            return resolve_charset(content, declared, sender)
         except Exception as e:
             logging.error(f"Encoding detection error: {e}")
             return 'gb18030'
@@ -119,10 +137,10 @@ class ContentProcessor:
         return urls[:5]
 
     @staticmethod
-    def convert_html_to_text(html_bytes):
+    def convert_html_to_text(html_bytes, charset=None, sender=None):
         """HTML转换强化"""
         try:
-            encoding = EmailDecoder.detect_encoding(html_bytes)
+            encoding = EmailDecoder.detect_encoding(html_bytes, charset, sender)
             html = html_bytes.decode(encoding, errors='replace')
             
             converter = html2text.HTML2Text()
@@ -153,11 +171,13 @@ class EmailHandler:
         """统一内容获取"""
         try:
             content = ""
+            # 发件人域名，用于缓存该域名邮件的编码
+            sender = parseaddr(str(msg.get("From", "")))[1].rpartition('@')[2].lower()
             # 优先处理HTML
             for part in msg.walk():
                 if part.get_content_type() == 'text/html':
                     html_bytes = part.get_payload(decode=True)
-                    content = ContentProcessor.convert_html_to_text(html_bytes)
+                    content = ContentProcessor.convert_html_to_text(html_bytes, part.get_content_charset(), sender)
                     break
                     
             # 次选纯文本
@@ -165,7 +185,7 @@ class EmailHandler:
                 for part in msg.walk():
                     if part.get_content_type() == 'text/plain':
                         text_bytes = part.get_payload(decode=True)
-                        encoding = EmailDecoder.detect_encoding(text_bytes)
+                        encoding = EmailDecoder.detect_encoding(text_bytes, part.get_content_charset(), sender)
                         raw_text = text_bytes.decode(encoding, errors='replace')
                         content = ContentProcessor.clean_text(raw_text)
                         break
@@ -213,27 +233,403 @@ class MessageFormatter:
 
     @staticmethod
     def split_content(text):
-        """智能分割优化"""
-        # 按空行分割段落
-        paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-        chunks = []
-        current_chunk = []
-        current_length = 0
-
-        for para in paragraphs:
-            para_length = len(para) + 2  # 加上换行符
-            if current_length + para_length > MAX_MESSAGE_LENGTH:
-                chunks.append('\n\n'.join(current_chunk))
-                current_chunk = []
-                current_length = 0
-                
-            current_chunk.append(para)
-            current_length += para_length
+        """智能分割优化：按段落装箱，超长段落依次按行、按词切分"""
+        return split_message(text, MAX_MESSAGE_LENGTH)
+
+class BodyStructure:
+    """解析 FETCH 响应中的 BODYSTRUCTURE，只取回需要的正文部分
+
+    get_email_content 只读取第一个 text/html 和第一个 text/plain 部分（HTML 为空时用纯文本），
+    以及是否存在图片。这两个文本部分按原样取回，图片只保留类型头，附件不再经过网络和内存。
+    """
+
+    TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+    LITERAL_PATTERN = re.compile(rb'\{(\d+)\}$')
+    CONTENT_HEADERS = (b'content-type:', b'content-transfer-encoding:', b'mime-version:')
+
+    @staticmethod
+    def tokenize(data):
+        """把 imaplib 返回的 [(前缀, 字面量), b')', ...] 展开为词法单元序列"""
+        for item in data:
+            if isinstance(item, tuple):
+                text, literal = item
+            else:
+                text, literal = item, None
+            if not text:
+                continue
+            if literal is not None:
+                text = BodyStructure.LITERAL_PATTERN.sub(b'', text.rstrip())
+            for match in BodyStructure.TOKEN_PATTERN.finditer(text):
+                open_paren, close_paren, quoted, atom = match.groups()
+                if open_paren:
+                    yield '('
+                elif close_paren:
+                    yield ')'
+                elif quoted is not None:
+                    yield re.sub(rb'\\(.)', rb'\1', quoted)
+                elif atom is not None:
+                    yield None if atom.upper() == b'NIL' else atom
+            if literal is not None:
+                yield literal
+
+    @staticmethod
+    def parse_response(data):
+        """解析 UID FETCH 响应，返回 {uid: {b'BODYSTRUCTURE': [...], b'BODY[1]': b'...', ...}}"""
+        root = []
+        stack = [root]
+        for token in BodyStructure.tokenize(data):
+            if token == '(':
+                stack.append([])
+            elif token == ')':
+                if len(stack) > 1:
+                    finished = stack.pop()
+                    stack[-1].append(finished)
+            else:
+                stack[-1].append(token)
+
+        results = {}
+        for item in root:
+            if not isinstance(item, list):
+                continue  # 序号
+            fields = {}
+            for i in range(0, len(item) - 1, 2):
+                if isinstance(item[i], bytes):
+                    fields[item[i].upper()] = item[i + 1]
+            uid = fields.get(b'UID')
+            if uid is not None:
+                results[int(uid)] = fields
+        return results
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8', errors='replace').lower() if isinstance(value, bytes) else ''
+
+    @staticmethod
+    def leaves(structure, prefix='', in_message=True):
+        """按 email.walk() 的先序依次产出 (部分编号, 单一部分结构)
+
+        in_message 表示 structure 是整封（或转发的）邮件的正文，非 multipart 时编号为 前缀+1。
+        """
+        if structure and isinstance(structure[0], list):
+            index = 0
+            for child in structure:
+                if not isinstance(child, list):
+                    break  # 子部分之后是 multipart 子类型
+                index += 1
+                yield from BodyStructure.leaves(child, f"{prefix}{index}.", in_message=False)
+            return
+        section = prefix + '1' if in_message else prefix[:-1]
+        yield section, structure
+        content_type = f"{BodyStructure._text(structure[0])}/{BodyStructure._text(structure[1])}"
+        if content_type == 'message/rfc822' and len(structure) > 8 and isinstance(structure[8], list):
+            # 转发的邮件：内层各部分编号为 n.1、n.2 ...
+            yield from BodyStructure.leaves(structure[8], f"{section}.")
+
+    @staticmethod
+    def select_parts(structure):
+        """返回 (文本部分列表 [(编号, 结构)], 第一个图片结构)
+
+        列表中依次为第一个 text/html 和第一个 text/plain 部分（存在时），
+        与 get_email_content 会读取的部分一致。
+        """
+        html_part = plain_part = image_part = None
+        for section, part in BodyStructure.leaves(structure):
+            maintype = BodyStructure._text(part[0])
+            content_type = f"{maintype}/{BodyStructure._text(part[1])}"
+            if content_type == 'text/html' and html_part is None:
+                html_part = (section, part)
+            elif content_type == 'text/plain' and plain_part is None:
+                plain_part = (section, part)
+            elif maintype == 'image' and image_part is None:
+                image_part = part
+        parts = [item for item in (html_part, plain_part) if item is not None]
+        # 整封邮件只有一个部分时用 TEXT，避免部分服务器对 BODY[1] 的差异
+        if structure and not isinstance(structure[0], list):
+            parts = [('TEXT', part) for _, part in parts]
+        return parts, image_part
+
+    @staticmethod
+    def content_headers(part):
+        maintype = BodyStructure._text(part[0])
+        subtype = BodyStructure._text(part[1])
+        content_type = f"{maintype}/{subtype}"
+        params = part[2] if len(part) > 2 and isinstance(part[2], list) else []
+        for i in range(0, len(params) - 1, 2):
+            name = BodyStructure._text(params[i])
+            value = params[i + 1].decode('utf-8', errors='replace') if isinstance(params[i + 1], bytes) else ''
+            if name == 'charset':
+                content_type += f'; charset="{value}"'
+        headers = [f"Content-Type: {content_type}".encode()]
+        encoding = BodyStructure._text(part[5]) if len(part) > 5 else ''
+        if encoding:
+            headers.append(f"Content-Transfer-Encoding: {encoding}".encode())
+        return headers
+
+    @staticmethod
+    def build_message(header, bodies, image_part=None):
+        """用原邮件头和取回的部分拼出一封等效邮件，交给原有解析流程
+
+        bodies 为 [(部分结构, 内容)]；只有一个部分且没有图片时拼成单一部分邮件，
+        否则拼成 multipart/mixed，图片部分只带类型头、内容为空。
+        """
+        lines = []
+        skipping = False
+        for line in header.replace(b'\r\n', b'\n').split(b'\n'):
+            if not line.strip():
+                continue
+            if line[:1] in (b' ', b'\t'):
+                if not skipping:
+                    lines.append(line)
+                continue
+            skipping = line.lower().startswith(BodyStructure.CONTENT_HEADERS)
+            if not skipping:
+                lines.append(line)
+        lines.append(b'MIME-Version: 1.0')
+
+        parts = list(bodies)
+        if image_part is not None:
+            parts.append((image_part, b''))
+        if len(parts) <= 1:
+            body = b''
+            if parts:
+                part, body = parts[0]
+                lines.extend(BodyStructure.content_headers(part))
+            return b'\r\n'.join(lines) + b'\r\n\r\n' + (body or b'')
+
+        boundary = f"=_partial_{uuid.uuid4().hex}".encode()
+        lines.append(b'Content-Type: multipart/mixed; boundary="' + boundary + b'"')
+        chunks = [b'\r\n'.join(lines) + b'\r\n\r\n']
+        for part, body in parts:
+            chunks.append(b'--' + boundary + b'\r\n')
+            chunks.append(b'\r\n'.join(BodyStructure.content_headers(part)) + b'\r\n\r\n')
+            chunks.append((body or b'') + b'\r\n')
+        chunks.append(b'--' + boundary + b'--\r\n')
+        return b''.join(chunks)
+
+class MailboxClient:
+    """按 UID 批量读取邮件：一次 SEARCH、每批一次 FETCH、最后一次 STORE
+
+    imaplib 是阻塞的，所有 IMAP 命令都经 run() 交给该连接专属的单线程执行，
+    既不阻塞事件循环，也保证同一连接上的命令不会并发。
+    """
+
+    UID_PATTERN = re.compile(rb'UID (\d+)')
+
+    def __init__(self, mail, batch_size=IMAP_FETCH_BATCH):
+        self.mail = mail
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='imap')
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.run(self.mail.logout), IMAP_LOGOUT_TIMEOUT)
+        except Exception:
+            # IMAP 线程可能仍阻塞在 IDLE 中，直接关闭套接字让它退出
+            try:
+                self.mail.shutdown()
+            except Exception:
+                pass
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def uid_set(uids):
+        """把 UID 列表压缩为 IMAP 序列集，例如 [1, 2, 3, 7] -> 1:3,7"""
+        ranges = []
+        for uid in sorted(uids):
+            if ranges and uid == ranges[-1][1] + 1:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+        return ','.join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+    def search_unseen(self):
+        status, data = self.mail.uid('SEARCH', None, 'UNSEEN')
+        if status != 'OK' or not data or not data[0]:
+            return []
+        return sorted(int(uid) for uid in data[0].split())
+
+    def fetch_messages(self, uids, partial=IMAP_PARTIAL_FETCH):
+        """按批次产出 (uid, 原始邮件)，批内按 UID 升序
+
+        使用 BODY.PEEK[] 取信，不会隐式设置 \\Seen；处理成功的邮件由 mark_seen 统一标记。
+        partial 为 True 时先取 BODYSTRUCTURE 和邮件头，再只取需要的正文部分。
+        """
+        for i in range(0, len(uids), self.batch_size):
+            chunk = uids[i:i + self.batch_size]
+            try:
+                messages = self._fetch_partial(chunk) if partial else self._fetch_full(chunk)
+            except imaplib.IMAP4.abort:
+                raise
+            except Exception as e:
+                logging.error(f"批量取信失败: {str(e)[:200]} {chunk[0]}-{chunk[-1]}")
+                continue
+            for uid in chunk:
+                if uid in messages:
+                    yield uid, messages[uid]
+
+    def _fetch_partial(self, uids):
+        try:
+            status, data = self.mail.uid('FETCH', self.uid_set(uids), '(UID BODYSTRUCTURE BODY.PEEK[HEADER])')
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"FETCH BODYSTRUCTURE {status}")
+            structures = BodyStructure.parse_response(data)
+        except imaplib.IMAP4.abort:
+            raise
+        except Exception as e:
+            # 服务器不支持或返回了无法解析的结构时整批改为完整取信
+            logging.warning(f"BODYSTRUCTURE 不可用，改为完整取信: {str(e)[:200]}")
+            return self._fetch_full(uids)
+
+        messages = {}
+        plans = {}
+        groups = {}
+        fallback = []
+        for uid, fields in structures.items():
+            structure = fields.get(b'BODYSTRUCTURE')
+            header = fields.get(b'BODY[HEADER]')
+            if not isinstance(structure, list) or not isinstance(header, bytes):
+                fallback.append(uid)
+                continue
+            try:
+                parts, image_part = BodyStructure.select_parts(structure)
+            except (IndexError, TypeError) as e:
+                logging.debug(f"无法解析 UID {uid} 的 BODYSTRUCTURE: {e}")
+                fallback.append(uid)
+                continue
+            if not parts:
+                # 没有文本部分：只保留图片类型供判断，正文为空
+                messages[uid] = BodyStructure.build_message(header, [], image_part)
+                continue
+            plans[uid] = (header, parts, image_part)
+            groups.setdefault(tuple(section for section, _ in parts), []).append(uid)
+
+        # 需要相同部分编号的邮件合并为一次 FETCH，通常每批只需一两次
+        for sections, group_uids in groups.items():
+            items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+            status, data = self.mail.uid('FETCH', self.uid_set(group_uids), f'(UID {items})')
+            if status != 'OK':
+                fallback.extend(group_uids)
+                continue
+            fetched = BodyStructure.parse_response(data)
+            for uid in group_uids:
+                header, parts, image_part = plans[uid]
+                fields = fetched.get(uid, {})
+                bodies = [(part, fields.get(f'BODY[{section}]'.encode())) for section, part in parts]
+                if not all(isinstance(body, bytes) for _, body in bodies):
+                    fallback.append(uid)
+                    continue
+                messages[uid] = BodyStructure.build_message(header, bodies, image_part)
+
+        if fallback:
+            messages.update(self._fetch_full(sorted(fallback)))
+        return messages
+
+    def _fetch_full(self, uids):
+        status, data = self.mail.uid('FETCH', self.uid_set(uids), '(UID BODY.PEEK[])')
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"FETCH {status}")
+        messages = {}
+        pending = None
+        for item in data:
+            if isinstance(item, tuple):
+                match = self.UID_PATTERN.search(item[0])
+                if match:
+                    messages[int(match.group(1))] = item[1]
+                    pending = None
+                else:
+                    pending = item[1]
+            elif pending is not None and item:
+                # 部分服务器把 UID 放在邮件正文之后返回
+                match = self.UID_PATTERN.search(item)
+                if match:
+                    messages[int(match.group(1))] = pending
+                pending = None
+        return messages
 
-        if current_chunk:
-            chunks.append('\n\n'.join(current_chunk))
+    def supports_idle(self):
+        return 'IDLE' in self.mail.capabilities
 
-        return chunks
+    def _has_buffered_data(self):
+        """不阻塞地检查 imaplib 读缓冲和 SSL 层中是否已有未读数据（select 看不到这部分）"""
+        sock = self.mail.sock
+        sock.setblocking(False)
+        try:
+            return bool(self.mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.setblocking(True)
+
+    def idle(self, timeout=IMAP_IDLE_TIMEOUT):
+        """发送 IDLE 并阻塞等待，收到 EXISTS / RECENT 推送或超时后发送 DONE 结束
+
+        imaplib 不支持 IDLE，这里直接收发原始行；返回是否收到新邮件通知。
+        连接断开时抛出 imaplib.IMAP4.abort，由调用方重连。
+        """
+        mail = self.mail
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        notified = False
+        # 服务器可以在 + 续行之前先发送 * N EXISTS、* OK 等未标记响应
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed before IDLE")
+            if line.startswith(b'+'):
+                break
+            if line.startswith(tag):
+                status = line[len(tag):].split(None, 1)[:1]
+                if status in ([b'NO'], [b'BAD']):
+                    raise imaplib.IMAP4.error(f"IDLE rejected: {line.strip()!r}")
+                # 未进入 IDLE 就已结束，不需要 DONE
+                return notified
+            logging.debug(f"IDLE: {line.strip()!r}")
+            if line.startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort(f"server closed connection: {line.strip()!r}")
+            if line.rstrip().endswith((b'EXISTS', b'RECENT')):
+                notified = True
+
+        deadline = time.monotonic() + timeout
+        try:
+            while not notified:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # 用 select 等待而不是设置套接字超时，超时后文件对象仍可继续读取
+                if not self._has_buffered_data():
+                    readable, _, _ = select.select([mail.sock], [], [], remaining)
+                    if not readable:
+                        break
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                logging.debug(f"IDLE: {line.strip()!r}")
+                if line.startswith(b'* BYE'):
+                    raise imaplib.IMAP4.abort(f"server closed connection: {line.strip()!r}")
+                if line.rstrip().endswith((b'EXISTS', b'RECENT')):
+                    notified = True
+        finally:
+            mail.send(b'DONE\r\n')
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed after IDLE")
+                if line.startswith(tag):
+                    break
+        return notified
+
+    def mark_seen(self, uids):
+        """返回是否标记成功"""
+        if not uids:
+            return True
+        status, _ = self.mail.uid('STORE', self.uid_set(uids), '+FLAGS.SILENT', '(\\Seen)')
+        if status != 'OK':
+            logging.error(f"标记已读失败: {status}")
+            return False
+        return True
 
 class TelegramBot:
     def __init__(self):
@@ -256,50 +652,218 @@ class TelegramBot:
             # 重新处理换行符确保格式
             final_text = ContentProcessor.normalize_newlines(final_text)
             
-            await self.bot.send_message(
-                chat_id=TELEGRAM_CHAT_ID,
-                text=final_text,
+            await send_queue.send_message(
+                self.bot,
+                TELEGRAM_CHAT_ID,
+                final_text,
                 parse_mode=None,
                 disable_web_page_preview=True
             )
         except Exception as e:
             logging.error(f"发送失败: {str(e)[:200]}")
 
-async def main():
-    bot = TelegramBot()
+def connect_mailbox():
+    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
+    mail.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+    mail.select("INBOX")
+    return mail
+
+def render_email(raw):
+    """解析并格式化一封邮件，在工作进程中执行"""
+    msg = email.message_from_bytes(raw)
     
+    sender = EmailDecoder.decode_email_header(msg.get("From"))
+    subject = EmailDecoder.decode_email_header(msg.get("Subject"))
+    content = EmailHandler.get_email_content(msg)
+
+    return MessageFormatter.format_message(sender, subject, content)
+
+_render_pool = None
+# 已转发但还没能标记为已读的 UID（连接中断时），重连后先标记，避免重复转发
+_unmarked_uids = set()
+
+# 各未读 UID 的解析失败次数，首次使用时从 MAIL_FAILURES_FILE 加载
+_render_failures = None
+
+def load_render_failures():
+    global _render_failures
+    if _render_failures is None:
+        _render_failures = {}
+        try:
+            with open(MAIL_FAILURES_FILE, 'r') as f:
+                _render_failures = {int(uid): count for uid, count in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"读取解析失败记录异常: {str(e)[:200]}")
+    return _render_failures
+
+def save_render_failures():
     try:
-        with imaplib.IMAP4_SSL(IMAP_SERVER) as mail:
-            mail.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            mail.select("INBOX")
-            
-            _, nums = mail.search(None, "UNSEEN")
-            if not nums[0]:
-                logging.info("无未读邮件")
-                return
+        with open(MAIL_FAILURES_FILE, 'w') as f:
+            json.dump({str(uid): count for uid, count in load_render_failures().items()}, f)
+    except Exception as e:
+        logging.error(f"保存解析失败记录异常: {str(e)[:200]}")
 
-            for num in nums[0].split():
-                try:
-                    _, data = mail.fetch(num, "(RFC822)")
-                    msg = email.message_from_bytes(data[0][1])
-                    
-                    sender = EmailDecoder.decode_email_header(msg.get("From"))
-                    subject = EmailDecoder.decode_email_header(msg.get("Subject"))
-                    content = EmailHandler.get_email_content(msg)
+def render_failed(uid):
+    """记录一次解析失败；达到 MAIL_MAX_RENDER_ATTEMPTS 次时返回 True，调用方放弃该邮件"""
+    failures = load_render_failures()
+    failures[uid] = failures.get(uid, 0) + 1
+    if failures[uid] < MAIL_MAX_RENDER_ATTEMPTS:
+        return False
+    logging.error(f"UID {uid} 已解析失败 {failures[uid]} 次，不再重试，标记为已读")
+    del failures[uid]
+    return True
 
-                    formatted = MessageFormatter.format_message(sender, subject, content)
-                    
-                    for chunk in MessageFormatter.split_content(formatted):
-                        await bot.send_message(chunk)
-                        
-                    mail.store(num, "+FLAGS", "\\Seen")
+def get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        if MAIL_PARSE_WORKERS > 1:
+            _render_pool = ProcessPoolExecutor(max_workers=MAIL_PARSE_WORKERS)
+        else:
+            _render_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='render')
+    return _render_pool
+
+async def flush_seen(client):
+    """把已转发的邮件标记为已读；失败时保留记录，下次处理（含重连后）再试"""
+    if _unmarked_uids and await client.run(client.mark_seen, sorted(_unmarked_uids)):
+        _unmarked_uids.clear()
+
+async def process_unseen(client, bot):
+    """转发全部未读邮件，返回处理的邮件数
+
+    取信 → 解析 → 发送三级流水线：IMAP 线程取回下一批的同时，工作进程解析、
+    事件循环发送前面的邮件。队列中按 UID 顺序存放解析任务，发送端依次等待，
+    因此发送顺序不变；队列有界，已取回未发送的邮件不超过 MAIL_PIPELINE_DEPTH 封。
+    """
+    global _render_pool
+    await flush_seen(client)
+    uids = await client.run(client.search_unseen)
+    failures = load_render_failures()
+    failures_before = dict(failures)
+    # 已读或已删除的邮件不再需要失败记录
+    unseen = set(uids)
+    for uid in [uid for uid in failures if uid not in unseen]:
+        del failures[uid]
+    if not uids:
+        if failures != failures_before:
+            save_render_failures()
+        return 0
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=MAIL_PIPELINE_DEPTH)
+
+    async def produce():
+        messages = client.fetch_messages(uids)
+        try:
+            while True:
+                item = await client.run(next, messages, None)
+                if item is None:
+                    break
+                uid, raw = item
+                pool = get_render_pool()
+                await queue.put((uid, pool, loop.run_in_executor(pool, render_email, raw)))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    processed = []
+    aborted = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            uid, pool, rendering = item
+            try:
+                formatted = await rendering
+                
+                for chunk in MessageFormatter.split_content(formatted):
+                    await bot.send_message(chunk)
                     
-                except Exception as e:
-                    logging.error(f"处理异常: {str(e)[:200]}")
-                    continue
+                processed.append(uid)
+                
+            except BrokenProcessPool as e:
+                # 工作进程异常退出，关闭并丢弃该进程池，下一封邮件重新创建；本封留待下次处理
+                logging.error(f"解析进程异常: {str(e)[:200]}")
+                pool.shutdown(wait=False, cancel_futures=True)
+                if _render_pool is pool:
+                    _render_pool = None
+                if render_failed(uid):
+                    processed.append(uid)
+            except Exception as e:
+                logging.error(f"处理异常: {str(e)[:200]}")
+                # 反复解析失败的邮件最终标记为已读，避免每轮都重新取回
+                if render_failed(uid):
+                    processed.append(uid)
+                continue
+        # 取信失败时抛出，由调用方处理（守护模式下重连）
+        await producer
+    except (imaplib.IMAP4.abort, OSError, asyncio.CancelledError):
+        aborted = True
+        raise
+    finally:
+        producer.cancel()
+        # 已处理的邮件一次性标记为已读；连接已断开时只记录，重连后再标记
+        _unmarked_uids.update(processed)
+        if failures != failures_before:
+            save_render_failures()
+        if not aborted:
+            try:
+                await flush_seen(client)
+            except Exception as e:
+                logging.error(f"标记已读异常，下次重试: {str(e)[:200]}")
+    return len(processed)
+
+async def main():
+    bot = TelegramBot()
+    
+    try:
+        mail = await asyncio.to_thread(connect_mailbox)
+        client = MailboxClient(mail)
+        try:
+            if not await process_unseen(client, bot):
+                logging.info("无未读邮件")
+        finally:
+            await client.close()
 
     except Exception as e:
         logging.error(f"连接异常: {str(e)[:200]}")
 
+async def run_daemon():
+    """常驻模式：保持连接，用 IDLE 等待新邮件推送（不支持时用 NOOP 轮询），断线后退避重连"""
+    bot = TelegramBot()
+    delay = IMAP_RECONNECT_MIN
+    while True:
+        client = None
+        try:
+            mail = await asyncio.to_thread(connect_mailbox)
+            client = MailboxClient(mail)
+            use_idle = client.supports_idle()
+            logging.info(f"已连接 {IMAP_SERVER}，{'IDLE 推送' if use_idle else f'每 {IMAP_POLL_INTERVAL} 秒轮询'}")
+            delay = IMAP_RECONNECT_MIN
+
+            while True:
+                count = await process_unseen(client, bot)
+                if count:
+                    logging.info(f"已转发 {count} 封邮件")
+                if use_idle:
+                    await client.run(client.idle)
+                else:
+                    await asyncio.sleep(IMAP_POLL_INTERVAL)
+                    await client.run(mail.noop)
+
+        except Exception as e:
+            logging.error(f"连接中断，{delay} 秒后重连: {str(e)[:200]}")
+        finally:
+            if client is not None:
+                await client.close()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, IMAP_RECONNECT_MAX)
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        # python3 mail.py --daemon 以常驻模式运行，否则处理一轮后退出（供 cron 调用）
+        asyncio.run(run_daemon() if '--daemon' in sys.argv else main())
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
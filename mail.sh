@@ -1,5 +1,25 @@
 #!/bin/bash
 
+# bash mail.sh --daemon：以 IMAP IDLE 常驻模式运行 mail.py。已在运行时不做任何事，
+# 不会打断正在进行的 IDLE，可以由 cron 定时调用，进程意外退出后自动拉起
+DAEMON_PATTERN='[ /]mail\.py --daemon'
+if [ "$1" = "--daemon" ]; then
+    if pgrep -f "$DAEMON_PATTERN" > /dev/null; then
+        echo "mail.py daemon is running."
+        exit 0
+    fi
+    source ~/rss/rss_venv/bin/activate
+    nohup python3 ~/rss/mail.py --daemon > /dev/null 2>&1 &
+    deactivate
+    exit 0
+fi
+
+# 常驻进程已经实时处理新邮件，不再执行单轮任务
+if pgrep -f "$DAEMON_PATTERN" > /dev/null; then
+    echo "mail.py daemon is running, skipping."
+    exit 0
+fi
+
 # 检查 mail.py 是否在运行
 if pgrep -f "mail.py" > /dev/null; then
     echo "mail.py is running. Stopping it..."
@@ -13,4 +33,4 @@ sleep 1
 # 运行 MAIL 脚本
 source ~/rss/rss_venv/bin/activate
 python3 ~/rss/mail.py &
-deactivate
\ No newline at end of file
+deactivate
@@ -0,0 +1,227 @@
+import re
+
+# Telegram 单条消息上限为 4096 个 UTF-16 码元（实体解析后）
+TELEGRAM_MAX_LENGTH = 4096
+
+# 切分点优先级：段落 > 换行 > 空格 > 其他位置
+BREAK_NONE = 0
+BREAK_SPACE = 1
+BREAK_LINE = 2
+BREAK_PARAGRAPH = 3
+
+
+
+def _span(delimiter, multiline=False):
+    """成对标记包围的实体；内容中的转义序列（如 \*）整体跳过，不会被当成闭标记"""
+    mark = re.escape(delimiter)
+    newline = '' if multiline else r'\n'
+    return rf'{mark}(?:\\.|(?!{mark})[^\\{newline}])+{mark}'
+
+
+# 各解析模式下不可拆开的实体（链接、加粗、代码块、转义序列、HTML 标签/字符实体）
+LINK = r'\[(?:\\.|[^\]\\\n])*\]\((?:\\.|[^)\\\n])*\)'
+ENTITY_PATTERNS = {
+    'Markdown': re.compile(
+        # 旧版 Markdown 的代码内没有转义，反斜杠是普通字符
+        rf'```.*?```|`[^`\n]*`|{LINK}|{_span("*")}|{_span("_")}|\\.',
+        re.S
+    ),
+    'MarkdownV2': re.compile(
+        rf'{_span("```", multiline=True)}|{_span("`")}|{LINK}|{_span("||", multiline=True)}|'
+        rf'{_span("__", multiline=True)}|{_span("*")}|{_span("_")}|{_span("~")}|\\.',
+        re.S
+    ),
+    'HTML': re.compile(
+        r'<(a|b|i|u|s|code|pre|strong|em|ins|del|strike|span|tg-spoiler|blockquote)\b[^>]*>.*?</\1\s*>'
+        r'|<[^>]+>|&#?\w+;',
+        re.S | re.I
+    ),
+}
+# 超长实体切开时，每段都重新包上开闭标记
+HTML_PAIR_PATTERN = re.compile(r'(<([\w-]+)\b[^>]*>)(.*)(</\2\s*>)', re.S | re.I)
+LINK_PARTS_PATTERN = re.compile(r'\[(.*)\](\(.*\))', re.S)
+CODE_BLOCK_OPENING = re.compile(r'```[^`\n]*\n')
+MARKDOWN_DELIMITERS = ('```', '||', '__', '*', '_', '~', '`')
+WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+
+
+def utf16_length(text):
+    """Telegram 按 UTF-16 码元计算消息长度"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def utf8_length(text):
+    return len(text.encode('utf-8'))
+
+
+def _break_level(token):
+    tail = token[len(token.rstrip()):]
+    if not tail:
+        return BREAK_NONE
+    if '\n\n' in tail:
+        return BREAK_PARAGRAPH
+    if '\n' in tail:
+        return BREAK_LINE
+    return BREAK_SPACE
+
+
+def _sized(token, measure):
+    return token, measure(token), _break_level(token)
+
+
+def _tokenize(text, parse_mode, measure):
+    """把文本切成 (片段, 长度, 片段后的切分优先级)，实体始终是一个完整片段"""
+    pattern = ENTITY_PATTERNS.get(parse_mode)
+    position = 0
+    if pattern is not None:
+        for match in pattern.finditer(text):
+            for word in WORD_PATTERN.finditer(text, position, match.start()):
+                yield _sized(word.group(), measure)
+            yield _sized(match.group(), measure)
+            position = match.end()
+    for word in WORD_PATTERN.finditer(text, position):
+        yield _sized(word.group(), measure)
+
+
+def _entity_parts(token, parse_mode):
+    """拆出实体的 (开标记, 内容, 闭标记)；不是成对标记的实体返回 None"""
+    if parse_mode == 'HTML':
+        match = HTML_PAIR_PATTERN.fullmatch(token)
+        return match.group(1, 3, 4) if match else None
+    if parse_mode not in ENTITY_PATTERNS:
+        return None
+    match = LINK_PARTS_PATTERN.fullmatch(token)
+    if match:
+        # 链接文字切开后每段都指向同一地址
+        return '[', match.group(1), ']' + match.group(2)
+    for delimiter in MARKDOWN_DELIMITERS:
+        if len(token) > 2 * len(delimiter) and token.startswith(delimiter) and token.endswith(delimiter):
+            opening = delimiter
+            if delimiter == '```':
+                # 代码块首行是语言标记，每段都要带上
+                match = CODE_BLOCK_OPENING.match(token)
+                if match:
+                    opening = match.group()
+            return opening, token[len(opening):-len(delimiter)], delimiter
+    return None
+
+
+def _split_oversized(token, room, limit, parse_mode, measure):
+    """切开超过 limit 的片段，第一段不超过 room（可以为空），其余各段不超过 limit
+
+    成对标记的实体按内容切分后每段重新包上开闭标记，格式不会在切分处断开；
+    其他片段（或标记占去分片一半以上时）只能按字符硬切。
+    """
+    parts = _entity_parts(token, parse_mode)
+    if parts is not None and measure(parts[0] + parts[2]) * 2 <= limit:
+        opening, inner, closing = parts
+        overhead = measure(opening + closing)
+        tokens = _tokenize(inner, parse_mode, measure)
+    else:
+        opening = closing = ''
+        overhead = 0
+        tokens = (_sized(char, measure) for char in token)
+
+    pieces = []
+    for text in _pack(tokens, limit - overhead, parse_mode, measure, room - overhead):
+        body = text.rstrip()
+        if body:
+            # 尾部空白放在闭标记之后，避免 "*粗体 *" 这类无效标记
+            text = opening + body + closing + text[len(body):]
+        pieces.append(_sized(text, measure))
+    return pieces
+
+
+def _pack(tokens, limit, parse_mode, measure, first_limit=None):
+    """把片段装箱成分片文本：第一片不超过 first_limit（默认 limit），其余不超过 limit
+
+    普通片段放不下时在已有内容里选切分点；超长片段无论如何都要切开，
+    所以先填满当前分片剩余的空间，分片数最少。
+    """
+    chunks = []
+    current = []
+    current_length = 0
+    capacity = limit if first_limit is None else max(first_limit, 0)
+    for token in tokens:
+        if token[1] > limit and len(token[0]) > 1:
+            first, *rest = _split_oversized(token[0], capacity - current_length, limit, parse_mode, measure)
+            chunks.append(''.join(part for part, _, _ in current) + first[0])
+            chunks.extend(part for part, _, _ in rest[:-1])
+            current = rest[-1:]
+            current_length = sum(length for _, length, _ in current)
+            capacity = limit
+            continue
+        while current and current_length + token[1] > capacity:
+            cut = _best_cut(current, capacity)
+            chunks.append(''.join(part for part, _, _ in current[:cut]))
+            current = current[cut:]
+            current_length = sum(length for _, length, _ in current)
+            capacity = limit
+        if not current and token[1] > capacity:
+            # 第一片的空间连一个片段都放不下
+            chunks.append('')
+            capacity = limit
+        current.append(token)
+        current_length += token[1]
+    if current:
+        chunks.append(''.join(part for part, _, _ in current))
+    return chunks
+
+
+def _best_cut(tokens, limit):
+    """在当前分片内选切分点：优先段落边界，其次换行、空格，且切出的分片至少半满"""
+    prefix = []
+    total = 0
+    for _, length, _ in tokens:
+        total += length
+        prefix.append(total)
+    for level in (BREAK_PARAGRAPH, BREAK_LINE, BREAK_SPACE):
+        for index in range(len(tokens) - 1, -1, -1):
+            if prefix[index] < limit / 2:
+                break
+            if tokens[index][2] >= level:
+                return index + 1
+    return len(tokens)
+
+
+def split_message(text, limit=TELEGRAM_MAX_LENGTH, parse_mode=None, measure=utf16_length):
+    """把消息装箱成尽量少的分片，每片不超过 limit 且不会拆开 Markdown/HTML 实体
+
+    单个实体本身超过 limit 时按内容切开，每段重新包上开闭标记。
+    parse_mode 取 'Markdown'、'MarkdownV2'、'HTML' 或 None（纯文本），
+    measure 为长度计算方式，默认按 Telegram 实际使用的 UTF-16 码元计算。
+    """
+    if measure(text) <= limit:
+        return [text] if text.strip() else []
+
+    chunks = _pack(_tokenize(text, parse_mode, measure), limit, parse_mode, measure)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+if __name__ == "__main__":
+    # 基准测试：大体量中文摘要（含 Markdown 链接）
+    import time
+
+    paragraph = "*今日要闻*\n" + "全球市场波动加剧，投资者关注央行政策走向。" * 12 + "\n[来源](https://example.com/news?id=1)"
+    digest = "\n\n".join(paragraph for _ in range(2000))
+
+    for mode in ('Markdown', None):
+        start = time.perf_counter()
+        chunks = split_message(digest, parse_mode=mode)
+        elapsed = time.perf_counter() - start
+        assert all(utf16_length(chunk) <= TELEGRAM_MAX_LENGTH for chunk in chunks)
+        if mode:
+            assert all(chunk.count('[') == chunk.count('](') for chunk in chunks)
+        print(f"{mode or 'plain'}: {len(digest)} chars -> {len(chunks)} chunks in {elapsed * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    naive = [digest[i:i + TELEGRAM_MAX_LENGTH] for i in range(0, len(digest), TELEGRAM_MAX_LENGTH)]
+    elapsed = time.perf_counter() - start
+    broken = sum(chunk.count('[') != chunk.count('](') for chunk in naive)
+    print(f"naive slicing: {len(naive)} chunks in {elapsed * 1000:.1f} ms, {broken} with broken links")
+
+    # 超长实体按内容切开，每段重新包上标记，并与前面的短片段一起装箱
+    chunks = split_message("*标题* *" + "要闻" * 6000 + "*", parse_mode='Markdown')
+    assert len(chunks) == 3 and all(chunk.startswith('*') and chunk.endswith('*') for chunk in chunks)
+    chunks = split_message("<b>" + "要闻" * 6000 + "</b>", parse_mode='HTML')
+    assert all(chunk.startswith('<b>') and chunk.endswith('</b>') for chunk in chunks)
@@ -0,0 +1,335 @@
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from seen_keys import key_digest, read_legacy_keys, read_seen_file, seen_path
+
+MMAP_INDEX = os.getenv("MMAP_INDEX", "0") == "1"  # 设为 1 时去重状态改用 mmap 索引文件
+MMAP_INDEX_MAX_ENTRIES = int(os.getenv("MMAP_INDEX_MAX_ENTRIES", "100000"))  # 未指定上限时保留的条目数
+MMAP_MAX_LOAD = 0.75  # 装载率上限，容量按 max_entries * MMAP_COMPACT_FACTOR 条不超过该装载率计算
+MMAP_COMPACT_FACTOR = 1.5  # 条目数超过保留上限的倍数时重建，只保留最近 max_entries 条
+WAL_ENTRIES = 64  # 预写日志容量，写满后执行一次检查点
+
+INDEX_MAGIC = b'MMIDX001'
+HEADER = struct.Struct('<8sQQQIQ')  # 魔数、槽位数、条目数、最近时间戳、日志条数、保留上限（0 表示未记录）
+WAL_RECORD = struct.Struct('<QQQ8s')  # 槽位、摘要、时间戳、校验和
+RECORD = struct.Struct('<QQ')  # 摘要（0 表示空槽）、写入时间（微秒）
+WAL_OFFSET = 64
+TABLE_OFFSET = 4096  # 哈希表从第二页开始，头部和日志只占第一页
+
+_open_indexes = {}  # 同一进程内同一文件只打开一次，文件锁不会和自己冲突
+
+
+def index_path(json_path):
+    """旧版 JSON 去重文件对应的索引文件路径（rss.json -> rss.idx）"""
+    return os.path.splitext(json_path)[0] + '.idx'
+
+
+def _capacity_for(max_entries):
+    capacity = 1024
+    while capacity * MMAP_MAX_LOAD < max_entries * MMAP_COMPACT_FACTOR:
+        capacity *= 2
+    return capacity
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def _wal_checksum(slot, digest, stamp):
+    return hashlib.blake2b(struct.pack('<QQQ', slot, digest, stamp), digest_size=8).digest()
+
+
+def _legacy_records(path):
+    """读取 .seen 摘要文件或旧版 JSON 文件，按写入顺序返回 [(摘要, 写入时间)]
+
+    rss_bbc 的 {'id', 'timestamp'} 记录带有原来的写入时间（换算为微秒），
+    其他格式没有时间，返回 None。
+    """
+    try:
+        records, _, _ = read_seen_file(path)
+        return [(digest, None) for digest in records]
+    except ValueError:
+        pass
+    stamps = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for item in data if isinstance(data, list) else []:
+            if isinstance(item, dict) and isinstance(item.get('timestamp'), (int, float)):
+                key = item.get('url') or item.get('subject') or item.get('id')
+                stamps[key] = int(item['timestamp'] * 1_000_000)
+    except ValueError:
+        pass  # JSONL 追加日志等格式没有时间
+    return [(key_digest(key), stamps.get(key)) for key in read_legacy_keys(path)]
+
+
+class MmapIndex:
+    """基于 mmap 的定长记录开放寻址哈希表
+
+    文件布局：第一页为头部和预写日志，之后是 capacity 个 16 字节槽位
+    （64 位摘要 + 写入时间），线性探测。打开文件不做任何反序列化，
+    查询和插入只触及所在的页面。每次插入先把（槽位, 摘要, 时间）写入日志
+    并 msync 第一页，再写哈希表；进程崩溃后打开时按日志重放，日志写满或
+    调用 save() 时把整张表刷盘并清空日志。
+    条目数超过 max_entries 的 MMAP_COMPACT_FACTOR 倍时重建文件，只保留最近 max_entries 条；
+    头部记录打开过该文件的各脚本中最大的上限，共用文件时不会互相截断。
+    设置 max_age（秒）时更早的条目视为不存在，并在重建时删除。
+    """
+
+    def __init__(self, file_path, max_entries=MMAP_INDEX_MAX_ENTRIES, max_age=None, legacy_paths=()):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._file = None
+        self._map = None
+        self._lock_file = open(file_path + '.lock', 'a+b')
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise RuntimeError(f"{file_path} is locked by another process")
+
+        try:
+            if not os.path.exists(file_path):
+                self._create(legacy_paths)
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _create(self, legacy_paths):
+        legacy = []
+        for path in legacy_paths:
+            if path and os.path.exists(path):
+                try:
+                    legacy = _legacy_records(path)
+                except Exception as e:
+                    logging.error(f"Error reading {path}: {e}")
+                    continue
+                logging.info(f"Migrating {len(legacy)} entries from {path} to {self.file_path}")
+                break
+        # 保留原来的写入时间，max_age 过期判断不受迁移影响；没有时间的旧记录按原顺序排在当前时间之前
+        now = _now_us()
+        records = [
+            (digest, now - len(legacy) + i if stamp is None else stamp)
+            for i, (digest, stamp) in enumerate(legacy)
+        ]
+        self._write_table(records)
+
+    def _write_table(self, records):
+        """把记录写入新文件并原子替换，只保留最近 max_entries 条"""
+        records = sorted(records, key=lambda record: record[1])[-self.max_entries:]
+        capacity = _capacity_for(self.max_entries)
+        data = bytearray(TABLE_OFFSET + capacity * RECORD.size)
+        mask = capacity - 1
+        count = 0
+        last_stamp = 0
+        for digest, stamp in records:
+            digest = digest or 1
+            slot = digest & mask
+            while True:
+                offset = TABLE_OFFSET + slot * RECORD.size
+                existing = RECORD.unpack_from(data, offset)[0]
+                if existing == 0:
+                    RECORD.pack_into(data, offset, digest, stamp)
+                    count += 1
+                    break
+                if existing == digest:
+                    RECORD.pack_into(data, offset, digest, stamp)
+                    break
+                slot = (slot + 1) & mask
+            last_stamp = max(last_stamp, stamp)
+        HEADER.pack_into(data, 0, INDEX_MAGIC, capacity, count, last_stamp, 0, self.max_entries)
+
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.idx')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _open(self):
+        self._file = open(self.file_path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.capacity, _, _, wal_length, bound = HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or len(self._map) != TABLE_OFFSET + self.capacity * RECORD.size:
+            raise ValueError(f"{self.file_path} is not a valid index file")
+        self.mask = self.capacity - 1
+        if not bound:
+            # 头部还没有记录上限的旧文件按容量推算
+            bound = int(self.capacity * MMAP_MAX_LOAD / MMAP_COMPACT_FACTOR)
+        # 多个脚本共用同一文件时按其中最大的上限保留，避免互相截断
+        self.max_entries = max(self.max_entries, bound)
+        if wal_length:
+            self._replay(wal_length)
+        if self.capacity < _capacity_for(self.max_entries):
+            # 保留上限调大后按新容量重建
+            self._rebuild()
+        elif bound != self.max_entries:
+            HEADER.pack_into(self._map, 0, *self._header()[:5], self.max_entries)
+            self._map.flush(0, TABLE_OFFSET)
+
+    def _replay(self, wal_length):
+        replayed = 0
+        for i in range(min(wal_length, WAL_ENTRIES)):
+            slot, digest, stamp, checksum = WAL_RECORD.unpack_from(self._map, WAL_OFFSET + i * WAL_RECORD.size)
+            if checksum != _wal_checksum(slot, digest, stamp) or slot >= self.capacity:
+                break
+            RECORD.pack_into(self._map, TABLE_OFFSET + slot * RECORD.size, digest, stamp)
+            replayed += 1
+        count = 0
+        last_stamp = 0
+        for digest, stamp in RECORD.iter_unpack(self._map[TABLE_OFFSET:]):
+            if digest:
+                count += 1
+                last_stamp = max(last_stamp, stamp)
+        HEADER.pack_into(self._map, 0, INDEX_MAGIC, self.capacity, count, last_stamp, wal_length, self.max_entries)
+        logging.info(f"Replayed {replayed} journal entries into {self.file_path}")
+        self.save()
+
+    def _header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    def _find(self, digest):
+        """返回 (槽位, 记录时间)；不存在时返回可插入的空槽位和 None"""
+        data = self._map
+        slot = digest & self.mask
+        while True:
+            existing, stamp = RECORD.unpack_from(data, TABLE_OFFSET + slot * RECORD.size)
+            if existing == digest:
+                return slot, stamp
+            if existing == 0:
+                return slot, None
+            slot = (slot + 1) & self.mask
+
+    def _cutoff(self):
+        if self.max_age is None:
+            return 0
+        return _now_us() - int(self.max_age * 1_000_000)
+
+    def __contains__(self, key):
+        _, stamp = self._find(key_digest(key) or 1)
+        return stamp is not None and stamp >= self._cutoff()
+
+    def __len__(self):
+        return self._header()[2]
+
+    def add(self, key):
+        digest = key_digest(key) or 1
+        slot, old_stamp = self._find(digest)
+        if old_stamp is not None and old_stamp >= self._cutoff():
+            return
+        _, capacity, count, last_stamp, wal_length, _ = self._header()
+        if old_stamp is None and count + 1 > min(capacity * MMAP_MAX_LOAD, self.max_entries * MMAP_COMPACT_FACTOR):
+            self._rebuild()
+            self.add(key)
+            return
+        stamp = max(_now_us(), last_stamp + 1)
+
+        if wal_length >= WAL_ENTRIES:
+            self.save()
+            wal_length = 0
+        WAL_RECORD.pack_into(self._map, WAL_OFFSET + wal_length * WAL_RECORD.size,
+                             slot, digest, stamp, _wal_checksum(slot, digest, stamp))
+        HEADER.pack_into(self._map, 0, INDEX_MAGIC, capacity, count, last_stamp, wal_length + 1, self.max_entries)
+        self._map.flush(0, TABLE_OFFSET)
+
+        RECORD.pack_into(self._map, TABLE_OFFSET + slot * RECORD.size, digest, stamp)
+        if old_stamp is None:
+            count += 1
+        HEADER.pack_into(self._map, 0, INDEX_MAGIC, capacity, count, stamp, wal_length + 1, self.max_entries)
+
+    def _rebuild(self):
+        cutoff = self._cutoff()
+        records = [
+            (digest, stamp) for digest, stamp in RECORD.iter_unpack(self._map[TABLE_OFFSET:])
+            if digest and stamp >= cutoff
+        ]
+        self._close_map()
+        self._write_table(records)
+        self._open()
+
+    def save(self):
+        """检查点：哈希表刷盘后清空日志"""
+        if self._map is None:
+            return
+        self._map.flush()
+        magic, capacity, count, last_stamp, _, bound = self._header()
+        HEADER.pack_into(self._map, 0, magic, capacity, count, last_stamp, 0, bound)
+        self._map.flush(0, TABLE_OFFSET)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        try:
+            self.save()
+        except Exception as e:
+            logging.error(f"Error saving {self.file_path}: {e}")
+        self._close_map()
+        _open_indexes.pop(os.path.abspath(self.file_path), None)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def open_index(json_path, max_entries=MMAP_INDEX_MAX_ENTRIES, max_age=None, file_path=None, legacy_paths=None):
+    """MMAP_INDEX=1 时打开 json_path 对应的索引文件，首次打开时从 .seen 或 JSON 文件迁移
+
+    未启用或打开失败（例如被其他进程锁定）时返回 None，调用方继续使用原来的存储。
+    """
+    if not MMAP_INDEX:
+        return None
+    file_path = file_path or index_path(json_path)
+    key = os.path.abspath(file_path)
+    index = _open_indexes.get(key)
+    if index is not None:
+        return index
+    try:
+        if legacy_paths is None:
+            legacy_paths = (seen_path(json_path), json_path)
+        index = MmapIndex(file_path, max_entries, max_age=max_age, legacy_paths=legacy_paths)
+    except Exception as e:
+        logging.error(f"Error opening index {file_path}, using {json_path}: {e}")
+        return None
+    _open_indexes[key] = index
+    return index
+
+
+if __name__ == "__main__":
+    # 转换旧文件：python3 mmap_index.py rss.json youtube.json --max-entries 100000
+    parser = argparse.ArgumentParser(description="Convert JSON / .seen dedup files to mmap index files")
+    parser.add_argument('files', nargs='+', help="legacy JSON files (the matching .seen file is used if present)")
+    parser.add_argument('--max-entries', type=int, default=MMAP_INDEX_MAX_ENTRIES)
+    parser.add_argument('--force', action='store_true', help="overwrite existing index files")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    for json_path in args.files:
+        target = index_path(json_path)
+        if os.path.exists(target):
+            if not args.force:
+                print(f"{target} already exists, skipping (use --force to rebuild)")
+                continue
+            os.remove(target)
+        index = MmapIndex(target, args.max_entries, legacy_paths=(seen_path(json_path), json_path))
+        print(f"{json_path} -> {target}: {len(index)} entries, {os.path.getsize(target) / 1024:.0f} KiB")
+        index.close()
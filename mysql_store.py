@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+MYSQL_FLUSH_BATCH_SIZE = 100  # 累积多少条后立即写库
+MYSQL_FLUSH_INTERVAL = 5  # 最早一条待写入记录最多等待的秒数
+MYSQL_LOOKUP_CHUNK = 500  # 单条 IN (...) 查询的最大参数个数
+MYSQL_RETENTION_DAYS = int(os.getenv("MYSQL_RETENTION_DAYS", "0"))  # 已发送记录保留天数，0 表示不清理
+MYSQL_PRUNE_BATCH = 5000  # 每条 DELETE 最多删除的行数，避免长事务
+
+
+def entry_hash(message_id):
+    """与 UNHEX(MD5(CONVERT(message_id USING utf8mb4))) 一致的 16 字节定长去重键"""
+    return hashlib.md5(message_id.encode('utf-8')).digest()
+
+
+async def ensure_dedup_schema(pool, table_name):
+    """为已发送表补充 entry_hash / sent_at 列、回填旧数据并建立索引
+
+    成功返回 True；没有 ALTER 权限等情况下返回 False，调用方改用 message_id 查询。
+    """
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                    (table_name,)
+                )
+                columns = {row[0] for row in await cursor.fetchall()}
+                added = 'entry_hash' not in columns
+                if added:
+                    logging.info(f"Adding entry_hash column to {table_name}")
+                    await cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN entry_hash BINARY(16) NULL")
+                if 'sent_at' not in columns:
+                    await cursor.execute(
+                        f"ALTER TABLE {table_name} ADD COLUMN sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP"
+                    )
+
+                await cursor.execute(f"SHOW INDEX FROM {table_name}")
+                indexed = {row[4] for row in await cursor.fetchall()}  # 第 5 列为 Column_name
+
+                # 回填旧记录；新记录写入时已带上哈希。索引建好后只用索引查一次是否还有
+                # 未回填的行（例如旧版本脚本写入的），不再每次启动都扫描整表
+                backfill = added or 'entry_hash' not in indexed
+                if not backfill:
+                    await cursor.execute(f"SELECT 1 FROM {table_name} WHERE entry_hash IS NULL LIMIT 1")
+                    backfill = bool(await cursor.fetchall())
+                if backfill:
+                    # 先转为 utf8mb4 再取 MD5，与 entry_hash() 对 UTF-8 字节的哈希一致，不受列字符集影响
+                    await cursor.execute(
+                        f"UPDATE {table_name} SET entry_hash = UNHEX(MD5(CONVERT(message_id USING utf8mb4))) "
+                        f"WHERE entry_hash IS NULL"
+                    )
+                    if cursor.rowcount:
+                        logging.info(f"Backfilled entry_hash for {cursor.rowcount} rows in {table_name}")
+                    await conn.commit()
+
+                if 'entry_hash' not in indexed:
+                    try:
+                        await cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE INDEX idx_entry_hash (entry_hash)")
+                    except Exception as e:
+                        # 历史数据里有重复 message_id 时无法建唯一索引，退回普通索引
+                        logging.warning(f"Unique index on {table_name}.entry_hash failed ({e}), using plain index")
+                        await cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_entry_hash (entry_hash)")
+                if 'sent_at' not in indexed:
+                    await cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_sent_at (sent_at)")
+        return True
+    except Exception as e:
+        logging.error(f"Error migrating dedup schema for {table_name}: {e}")
+        return False
+
+
+class SentEntryIndex:
+    """按需查询的已发送集合
+
+    不再启动时整表加载，而是每个源抓取后用 prefetch() 只查询本次出现的条目
+    （WHERE entry_hash IN (...)），内存占用与单次抓取量成正比。
+    以 (url, subject, message_id) 为键，兼容原来的集合用法（in / add）。
+    """
+
+    def __init__(self, pool, table_name, hashed=True):
+        self.pool = pool
+        self.table_name = table_name
+        self.hashed = hashed
+        self.known = set()
+        self.checked = set()
+
+    def _lookup_key(self, key):
+        message_id = key[2]
+        if message_id is None:
+            return None
+        return entry_hash(message_id) if self.hashed else message_id
+
+    async def prefetch(self, keys):
+        candidates = []
+        for key in keys:
+            lookup_key = self._lookup_key(key)
+            if lookup_key is not None and lookup_key not in self.checked:
+                self.checked.add(lookup_key)
+                candidates.append(lookup_key)
+        if not candidates:
+            return
+
+        column = 'entry_hash' if self.hashed else 'message_id'
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    for i in range(0, len(candidates), MYSQL_LOOKUP_CHUNK):
+                        chunk = candidates[i:i + MYSQL_LOOKUP_CHUNK]
+                        placeholders = ','.join(['%s'] * len(chunk))
+                        await cursor.execute(
+                            f"SELECT {column} FROM {self.table_name} WHERE {column} IN ({placeholders})",
+                            chunk
+                        )
+                        self.known.update(row[0] for row in await cursor.fetchall())
+        except Exception as e:
+            logging.error(f"Error loading sent entries from {self.table_name}: {e}")
+            self.checked.difference_update(candidates)
+
+    def __contains__(self, key):
+        lookup_key = self._lookup_key(key)
+        return lookup_key is not None and lookup_key in self.known
+
+    def add(self, key):
+        lookup_key = self._lookup_key(key)
+        if lookup_key is not None:
+            self.known.add(lookup_key)
+            self.checked.add(lookup_key)
+
+
+async def prune_sent_entries(pool, table_name, retention_days=MYSQL_RETENTION_DAYS):
+    """删除超过保留期的记录，分批执行；retention_days 不大于 0 时不清理
+
+    被删除的记录如果仍在订阅源中出现会被再次发送，所以默认关闭，需要时通过
+    MYSQL_RETENTION_DAYS 开启。
+    """
+    if retention_days <= 0:
+        return
+    total = 0
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                while True:
+                    await cursor.execute(
+                        f"DELETE FROM {table_name} WHERE sent_at < NOW() - INTERVAL %s DAY LIMIT {MYSQL_PRUNE_BATCH}",
+                        (retention_days,)
+                    )
+                    await conn.commit()
+                    total += cursor.rowcount
+                    if cursor.rowcount < MYSQL_PRUNE_BATCH:
+                        break
+        if total:
+            logging.info(f"Pruned {total} entries older than {retention_days} days from {table_name}")
+    except Exception as e:
+        logging.error(f"Error pruning {table_name}: {e}")
+
+
+class SentEntryBuffer:
+    """已发送条目的写缓冲
+
+    add() 只把记录放入内存，累积到 batch_size 条或等待超过 flush_interval 秒时，
+    用一条多行 INSERT IGNORE 在同一个事务中写入；退出前调用 close() 写入剩余记录。
+    写库失败的记录保留在缓冲中，下次刷新时重试。hashed 为 True 时同时写入 entry_hash。
+    """
+
+    def __init__(self, pool, table_name, hashed=True, batch_size=MYSQL_FLUSH_BATCH_SIZE,
+                 flush_interval=MYSQL_FLUSH_INTERVAL):
+        self.pool = pool
+        self.table_name = table_name
+        self.hashed = hashed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self._timer = None
+
+    async def add(self, url, subject, message_id):
+        if self.hashed:
+            self.pending.append((url, subject, message_id, entry_hash(message_id)))
+        else:
+            self.pending.append((url, subject, message_id))
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            rows, self.pending = self.pending, []
+            if self.hashed:
+                sql = (f"INSERT IGNORE INTO {self.table_name} (url, subject, message_id, entry_hash) "
+                       f"VALUES (%s, %s, %s, %s)")
+            else:
+                sql = f"INSERT IGNORE INTO {self.table_name} (url, subject, message_id) VALUES (%s, %s, %s)"
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.cursor() as cursor:
+                        # executemany 会把 VALUES 子句改写为一条多行 INSERT
+                        await cursor.executemany(sql, rows)
+                    await conn.commit()
+            except Exception as e:
+                logging.error(f"Error saving {len(rows)} entries to {self.table_name}: {e}")
+                self.pending = rows + self.pending
+
+    async def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self.pending:
+            logging.error(f"{len(self.pending)} entries could not be saved to {self.table_name}")
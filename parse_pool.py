@@ -0,0 +1,72 @@
+import asyncio
+import atexit
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from feedparser import parse
+from youtube_atom import is_youtube_atom, parse_youtube_feed
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))  # 解析进程数，默认等于 CPU 核数
+PARSE_INLINE_BYTES = 32 * 1024  # 小于该大小的文档放线程池解析，省去进程间传输开销
+
+_process_pool = None
+_thread_pool = None
+
+
+def _parse(content):
+    result = parse(content)
+    # bozo_exception 多为 SAX 异常对象，不一定能 pickle 回主进程
+    if 'bozo_exception' in result:
+        result['bozo_exception'] = repr(result['bozo_exception'])
+    return result
+
+
+def _get_thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=max(PARSE_WORKERS, 2), thread_name_prefix='parse')
+    return _thread_pool
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None and PARSE_WORKERS > 1:
+        _process_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return _process_pool
+
+
+async def parse_feed(content):
+    """在工作池中解析订阅源，不阻塞事件循环
+
+    多核机器上大文档交给进程池并行解析；单核或小文档走线程池。
+    各抓取协程下载完成后立即提交解析，下载与解析自然重叠。
+    YouTube Atom 文档走快速路径，在线程池中解析。
+    """
+    loop = asyncio.get_running_loop()
+    if is_youtube_atom(content):
+        fast = await loop.run_in_executor(_get_thread_pool(), parse_youtube_feed, content)
+        if fast is not None:
+            return fast
+
+    pool = _get_process_pool() if len(content) >= PARSE_INLINE_BYTES else None
+    if pool is not None:
+        try:
+            return await loop.run_in_executor(pool, _parse, content)
+        except BrokenProcessPool as e:
+            logging.error(f"Parse process pool broken, falling back to threads: {e}")
+            shutdown_parse_pool()
+    return await loop.run_in_executor(_get_thread_pool(), _parse, content)
+
+
+def shutdown_parse_pool():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False)
+        _thread_pool = None
+
+
+atexit.register(shutdown_parse_pool)
@@ -1,17 +1,21 @@
 import asyncio
 import aiohttp
 import logging
-import re
 import os
-import json
+import sys
 import time
+from contextlib import closing
 from dotenv import load_dotenv
-from feedparser import parse
+from feed_state import FeedState, fetch_if_changed, iter_new_entries
+from feed_scheduler import FeedScheduler
+from mmap_index import open_index
+from seen_keys import SeenKeys, seen_path
+from parse_pool import parse_feed
+from sanitizers import escape_markdown
 from telegram import Bot
-from tencentcloud.common import credential
-from tencentcloud.common.profile.client_profile import ClientProfile
-from tencentcloud.common.profile.http_profile import HttpProfile
-from tencentcloud.tmt.v20180321 import tmt_client, models
+from telegram_sender import send_queue
+from message_chunker import split_message
+from translator import TencentTranslator
 
 # 加载.env 文件
 load_dotenv()
@@ -67,66 +71,49 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "").split(",")
 SENT_ENTRIES_FILE = "rss.json"
 SENT_ENTRIES_FILE_THIRD = "rss2.json"
 SENT_ENTRIES_FILE_FOURTH = "rss3.json"
+FEED_STATE_FILE = "rss_feed_state.json"
 
 TENCENTCLOUD_SECRET_ID = os.getenv("TENCENTCLOUD_SECRET_ID")
 TENCENTCLOUD_SECRET_KEY = os.getenv("TENCENTCLOUD_SECRET_KEY")
 
+# 全局复用的翻译客户端（线程池 + QPS 限制）
+translator = TencentTranslator(TENCENTCLOUD_SECRET_ID, TENCENTCLOUD_SECRET_KEY)
+
 MAX_ENTRIES_TO_KEEP = 5000
-TELEGRAM_DELAY = 0.5  # 发送消息后的延迟时间（秒）
 MAX_RETRIES = 3  # 最大重试次数
 RETRY_DELAY = 1  # 初始重试延迟（秒）
 
-def sanitize_markdown(text):
-    # 首先去除 HTML 标签
-    text = re.sub(r'<[^>]*>', '', text)
-    # 然后去除 Telegram 不支持的 Markdown 符号
-    # 这里添加了更多的转义
-    text = re.sub(r'([*_`\[\]\(\)\~>#+\-=|{}.!])', r'\\\1', text)
-    return text
+# 条件请求缓存（ETag / Last-Modified / 内容哈希）
+feed_state = FeedState(FEED_STATE_FILE)
+
+def entry_key(entry):
+    """去重键：规范化后的链接，没有链接时用标题"""
+    return entry.link or entry.title or "*无标题*"
 
-async def send_single_message(bot, chat_id, text, disable_web_page_preview=True, retry_count=0):
+async def send_single_message(bot, chat_id, text, disable_web_page_preview=True):
     try:
-        # Telegram 最大消息字节数限制：4096字节
-        MAX_MESSAGE_LENGTH = 4096
-        # 计算消息的字节数
-        if len(text.encode('utf-8')) > MAX_MESSAGE_LENGTH:
-            # 如果超长，拆分为多个消息
-            for i in range(0, len(text), MAX_MESSAGE_LENGTH):
-                await bot.send_message(
-                    chat_id=chat_id, 
-                    text=text[i:i+MAX_MESSAGE_LENGTH], 
-                    parse_mode='Markdown', 
-                    disable_web_page_preview=disable_web_page_preview
-                )
-                await asyncio.sleep(TELEGRAM_DELAY) # 添加延迟
-        else:
-            # 如果没有超长，直接发送
-            await bot.send_message(
-                chat_id=chat_id, 
-                text=text, 
-                parse_mode='Markdown', 
+        # 按 UTF-16 长度切分，且不会拆开 Markdown 链接、加粗等实体
+        for chunk in split_message(text, parse_mode='Markdown'):
+            # 限速与 429 重试由发送调度统一处理
+            await send_queue.send_message(
+                bot,
+                chat_id,
+                chunk,
+                parse_mode='Markdown',
                 disable_web_page_preview=disable_web_page_preview
             )
-            await asyncio.sleep(TELEGRAM_DELAY) # 添加延迟
     except Exception as e:
-        logging.error(f"Failed to send message (attempt {retry_count+1}): {e}, message: {text}")
-        if retry_count < MAX_RETRIES:
-            delay = RETRY_DELAY * (2 ** retry_count)
-            logging.info(f"Retrying in {delay} seconds...")
-            await asyncio.sleep(delay)
-            return await send_single_message(bot, chat_id, text, disable_web_page_preview, retry_count + 1)
-        else:
-             logging.error(f"Max retries exceeded for message: {text}")
+        logging.error(f"Failed to send message: {e}, message: {text}")
 
 async def fetch_feed(session, feed_url, retry_count=0):
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36'
     }
     try:
-        async with session.get(feed_url, headers=headers, timeout=60) as response: # 增加超时时间
-            response.raise_for_status()
-            content = await response.read()
-            return parse(content)
+        content = await fetch_if_changed(session, feed_url, feed_state, headers=headers, timeout=60) # 增加超时时间
+        if content is None:
+            return None
+        return await parse_feed(content)
     except aiohttp.ClientError as e:
         logging.error(f"Error fetching {feed_url} (attempt {retry_count+1}): {e}")
         if retry_count < MAX_RETRIES:
@@ -141,53 +128,57 @@ async def fetch_feed(session, feed_url, retry_count=0):
         logging.error(f"Error fetching {feed_url} (attempt {retry_count+1}): {e}")
         return None
 
-async def auto_translate_text(text):
+async def auto_translate_texts(texts):
+    """批量翻译，失败时返回原文"""
     try:
-        cred = credential.Credential(TENCENTCLOUD_SECRET_ID, TENCENTCLOUD_SECRET_KEY)
-        httpProfile = HttpProfile(endpoint="tmt.tencentcloudapi.com")
-        clientProfile = ClientProfile(httpProfile=httpProfile)
-        client = tmt_client.TmtClient(cred, "na-siliconvalley", clientProfile)
-
-        req = models.TextTranslateRequest()
-        req.SourceText = text
-        req.Source = "auto"
-        req.Target = "zh"
-        req.ProjectId = 0
-
-        resp = client.TextTranslate(req)
-        return resp.TargetText
+        return await translator.translate_batch(texts)
     except Exception as e:
-        logging.error(f"Translation error for text '{text}': {e}")
-        return text
+        logging.error(f"Translation error for {len(texts)} texts: {e}")
+        return list(texts)
 # 主题+翻意内容+预览
-async def process_feed(session, feed_url, sent_entries, bot, file_path, translate=True):
+async def process_feed(session, feed_url, sent_entries, bot, translate=True):
     feed_data = await fetch_feed(session, feed_url)
     if feed_data is None:
         return []
 
     source_name = feed_data.feed.get('title', feed_url)  # 动态获取源名称
     new_entries = []
+    pending = []
+
+    # 条目按时间倒序，遇到已发送的条目即可提前结束
+    with closing(iter_new_entries(feed_data.entries, feed_url, feed_state, lambda entry: entry_key(entry) in sent_entries)) as entries:
+        for entry in entries:
+            subject = entry.title or "*无标题*"
+            url = entry.link
+            summary = getattr(entry, 'summary', "暂无简介")
+            key = url or subject
+
+            if key not in sent_entries:
+                pending.append((entry, url, subject, summary, key))
+            else:
+                feed_state.mark_processed(feed_url, entry)
+
+    if not pending:
+        feed_state.commit(feed_url)
+        return []
 
-    for entry in feed_data.entries:
-        subject = entry.title or "*无标题*"
-        url = entry.link
-        summary = getattr(entry, 'summary', "暂无简介")
-        message_id = f"{subject}_{url}"
+    # 整个源的标题和简介合并为一次批量翻译
+    texts = [text for _, _, subject, summary, _ in pending for text in (subject, summary)]
+    translated = await auto_translate_texts(texts) if translate else texts
 
-        if (url, subject, message_id) not in sent_entries:
-            if translate:
-                translated_subject = await auto_translate_text(subject)
-                translated_summary = await auto_translate_text(summary)
-            else:
-                translated_subject = subject
-                translated_summary = summary
+    for i, (entry, url, subject, summary, key) in enumerate(pending):
+        # 翻译期间其他任务可能已发送同一条目
+        if key not in sent_entries:
+            translated_subject = translated[2 * i]
+            translated_summary = translated[2 * i + 1]
 
-            cleaned_subject = sanitize_markdown(translated_subject)
-            cleaned_summary = sanitize_markdown(translated_summary)
+            cleaned_subject = escape_markdown(translated_subject)
+            cleaned_summary = escape_markdown(translated_summary)
             message = f"*{cleaned_subject}*\n{cleaned_summary}\n[{source_name}]({url})"
 
             if len(message.encode('utf-8')) > 4096:
                 logging.warning(f"Message too long, skipping: {message}")
+                feed_state.mark_processed(feed_url, entry)
                 continue
 
             try:
@@ -195,41 +186,47 @@ async def process_feed(session, feed_url, sent_entries, bot, file_path, translat
             except Exception as e:
                 logging.error(f"Error sending message for subject '{cleaned_subject}': {e}")
 
-            new_entries.append((url, subject, message_id))
-            sent_entries.add((url, subject, message_id))
-            await save_sent_entries(sent_entries, file_path)
+            new_entries.append(key)
+            sent_entries.add(key)
+        feed_state.mark_processed(feed_url, entry)
 
 
+    feed_state.commit(feed_url)
     return new_entries
 # 主题+内容 超过333字节不发送
-async def process_third_feed(session, feed_url, sent_entries, bot, file_path):
+async def process_third_feed(session, feed_url, sent_entries, bot):
     feed_data = await fetch_feed(session, feed_url)
     if feed_data is None:
         return []
 
     source_name = feed_data.feed.get('title', feed_url)  # 动态获取源名称
+    new_entries = []
     merged_message = ""
 
-    for entry in feed_data.entries:
-        subject = entry.title or "*无标题*"
-        url = entry.link
-        summary = getattr(entry, 'summary', "暂无简介")
-        summary = sanitize_markdown(summary)
-        message_id = f"{subject}_{url}"
-
-        if (url, subject, message_id) not in sent_entries:
-            cleaned_subject = sanitize_markdown(subject)
-
-            # 检查主题和内容的字节长度
-            total_length = len(cleaned_subject.encode('utf-8')) + len(summary.encode('utf-8'))
-            if total_length > 333:
-                # 超过 333 字节的内容直接跳过，不发送
-                continue
-            else:
-                # 如果字节长度不超过 333 字节，则合并发送
-                merged_message += f"*{cleaned_subject}*\n{summary}\n[{source_name}]({url})\n\n"
-                sent_entries.add((url, subject, message_id))
-                await save_sent_entries(sent_entries, file_path)
+    # 条目按时间倒序，遇到已发送的条目即可提前结束
+    with closing(iter_new_entries(feed_data.entries, feed_url, feed_state, lambda entry: entry_key(entry) in sent_entries)) as entries:
+        for entry in entries:
+            subject = entry.title or "*无标题*"
+            url = entry.link
+            summary = getattr(entry, 'summary', "暂无简介")
+            summary = escape_markdown(summary)
+            key = url or subject
+
+            if key not in sent_entries:
+                cleaned_subject = escape_markdown(subject)
+
+                # 检查主题和内容的字节长度
+                total_length = len(cleaned_subject.encode('utf-8')) + len(summary.encode('utf-8'))
+                if total_length > 333:
+                    # 超过 333 字节的内容直接跳过，不发送
+                    feed_state.mark_processed(feed_url, entry)
+                    continue
+                else:
+                    # 如果字节长度不超过 333 字节，则合并发送
+                    merged_message += f"*{cleaned_subject}*\n{summary}\n[{source_name}]({url})\n\n"
+                    new_entries.append(key)
+                    sent_entries.add(key)
+            feed_state.mark_processed(feed_url, entry)
 
     if merged_message:
         # 发送合并后的消息
@@ -239,28 +236,33 @@ async def process_third_feed(session, feed_url, sent_entries, bot, file_path):
             logging.error(f"Error sending merged message: {e}")
 
 
-    return []
+    feed_state.commit(feed_url)
+    return new_entries
 
 # 主题+预览
-async def process_fourth_feed(session, feed_url, sent_entries, bot, file_path):
+async def process_fourth_feed(session, feed_url, sent_entries, bot):
     feed_data = await fetch_feed(session, feed_url)
     if feed_data is None:
         return []
 
     source_name = feed_data.feed.get('title', feed_url)  # 动态获取源名称
+    new_entries = []
     merged_message = ""
 
-    for entry in feed_data.entries:
-        subject = entry.title or "*无标题*"
-        url = entry.link
-        message_id = f"{subject}_{url}"
+    # 条目按时间倒序，遇到已发送的条目即可提前结束
+    with closing(iter_new_entries(feed_data.entries, feed_url, feed_state, lambda entry: entry_key(entry) in sent_entries)) as entries:
+        for entry in entries:
+            subject = entry.title or "*无标题*"
+            url = entry.link
+            key = url or subject
 
-        if (url, subject, message_id) not in sent_entries:
-            cleaned_subject = sanitize_markdown(subject)
-            merged_message += f"{source_name}\n*{cleaned_subject}*\n{url}\n\n"
+            if key not in sent_entries:
+                cleaned_subject = escape_markdown(subject)
+                merged_message += f"{source_name}\n*{cleaned_subject}*\n{url}\n\n"
 
-            sent_entries.add((url, subject, message_id))
-            await save_sent_entries(sent_entries, file_path)
+                new_entries.append(key)
+                sent_entries.add(key)
+            feed_state.mark_processed(feed_url, entry)
 
     if merged_message:
         try:
@@ -269,56 +271,82 @@ async def process_fourth_feed(session, feed_url, sent_entries, bot, file_path):
             logging.error(f"Error sending merged message: {e}")
 
 
-    return []
+    feed_state.commit(feed_url)
+    return new_entries
 
-# 加载本地保存的已发送条目
+# 加载本地保存的已发送条目（64 位摘要，新增条目只追加 8 字节）
+# 旧版 rss.json / rss2.json / rss3.json 在首次运行时迁移到同名 .seen 文件
+# MMAP_INDEX=1 时改用同名 .idx 索引文件
 def load_sent_entries(file_path):
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # 将加载的数据转换为集合，并限制大小
-                return set(tuple(item) for item in data[-MAX_ENTRIES_TO_KEEP:])
-        except Exception as e:
-            logging.error(f"Error loading sent entries from {file_path}: {e}")
-            return set()
-    return set()
-
-# 保存已发送条目到本地文件
-async def save_sent_entries(sent_entries, file_path):
-    try:
-        # 限制保存的条目数量
-        entries_to_save = list(sent_entries)[-MAX_ENTRIES_TO_KEEP:]
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(entries_to_save, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logging.error(f"Error saving sent entries to {file_path}: {e}")
+    index = open_index(file_path, MAX_ENTRIES_TO_KEEP)
+    if index is not None:
+        return index
+    return SeenKeys(seen_path(file_path), MAX_ENTRIES_TO_KEEP, legacy_path=file_path)
 
 async def main():
     sent_entries = load_sent_entries(SENT_ENTRIES_FILE)
     sent_entries_third = load_sent_entries(SENT_ENTRIES_FILE_THIRD)
     sent_entries_fourth = load_sent_entries(SENT_ENTRIES_FILE_FOURTH)
 
-    connector = aiohttp.TCPConnector(limit=200)  # 增加连接池大小
-    async with aiohttp.ClientSession(connector=connector) as session:
-        bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        third_bot = Bot(token=RSS_TWO)
-        fourth_bot = Bot(token=RSS_TOKEN)
-
-        tasks = [
-            process_feed(session, feed_url, sent_entries, bot, SENT_ENTRIES_FILE, translate=True)
-            for feed_url in RSS_FEEDS
-        ] + [
-            process_third_feed(session, feed_url, sent_entries_third, third_bot, SENT_ENTRIES_FILE_THIRD)
-            for feed_url in THIRD_RSS_FEEDS
-        ] + [
-             process_fourth_feed(session, feed_url, sent_entries_fourth, fourth_bot, SENT_ENTRIES_FILE_FOURTH)
-            for feed_url in FOURTH_RSS_FEEDS
-        ]
+    try:
+        connector = aiohttp.TCPConnector(limit=200)  # 增加连接池大小
+        async with aiohttp.ClientSession(connector=connector) as session:
+            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            third_bot = Bot(token=RSS_TWO)
+            fourth_bot = Bot(token=RSS_TOKEN)
+
+            tasks = [
+                process_feed(session, feed_url, sent_entries, bot, translate=True)
+                for feed_url in RSS_FEEDS
+            ] + [
+                process_third_feed(session, feed_url, sent_entries_third, third_bot)
+                for feed_url in THIRD_RSS_FEEDS
+            ] + [
+                 process_fourth_feed(session, feed_url, sent_entries_fourth, fourth_bot)
+                for feed_url in FOURTH_RSS_FEEDS
+            ]
+
+            await asyncio.gather(*tasks)
+
+        feed_state.save()
+    finally:
+        for store in (sent_entries, sent_entries_third, sent_entries_fourth):
+            store.close()
+        translator.close()
+
+async def run_daemon():
+    """常驻模式：复用同一个会话和去重状态，按各源的更新频率自适应轮询"""
+    sent_entries = load_sent_entries(SENT_ENTRIES_FILE)
+    sent_entries_third = load_sent_entries(SENT_ENTRIES_FILE_THIRD)
+    sent_entries_fourth = load_sent_entries(SENT_ENTRIES_FILE_FOURTH)
 
-        await asyncio.gather(*tasks)
+    try:
+        connector = aiohttp.TCPConnector(limit=200)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            bot = Bot(token=TELEGRAM_BOT_TOKEN)
+            third_bot = Bot(token=RSS_TWO)
+            fourth_bot = Bot(token=RSS_TOKEN)
+            scheduler = FeedScheduler(feed_state)
+
+            for feed_url in RSS_FEEDS:
+                scheduler.add(feed_url, lambda url=feed_url: process_feed(session, url, sent_entries, bot, translate=True))
+            for feed_url in THIRD_RSS_FEEDS:
+                scheduler.add(feed_url, lambda url=feed_url: process_third_feed(session, url, sent_entries_third, third_bot))
+            for feed_url in FOURTH_RSS_FEEDS:
+                scheduler.add(feed_url, lambda url=feed_url: process_fourth_feed(session, url, sent_entries_fourth, fourth_bot))
+
+            await scheduler.run_forever()
+    finally:
+        feed_state.save()
+        for store in (sent_entries, sent_entries_third, sent_entries_fourth):
+            store.close()
+        translator.close()
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    asyncio.run(main())
+    try:
+        # python3 rss.py --daemon 以常驻模式运行，否则执行一轮后退出（供 cron 调用）
+        asyncio.run(run_daemon() if '--daemon' in sys.argv else main())
+    except KeyboardInterrupt:
+        pass
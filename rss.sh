@@ -12,6 +12,25 @@ source rss_venv/bin/activate
 # 定义日志文件路径
 LOG_FILE="rss_error.log"
 
+# bash rss.sh --daemon：以常驻模式启动 rss.py，已在运行时直接退出，
+# 可以由 cron 定时调用，进程意外退出后自动拉起
+DAEMON_PATTERN='[ /]rss\.py --daemon'
+if [ "$1" = "--daemon" ]; then
+  if ! pgrep -f "$DAEMON_PATTERN" > /dev/null; then
+    nohup python3 rss.py --daemon > /dev/null 2>> "$LOG_FILE" &
+    echo "$(date) - 常驻模式已启动" >> rss.log
+  fi
+  deactivate
+  exit 0
+fi
+
+# 常驻进程在运行时不再执行单轮任务，避免重复发送
+if pgrep -f "$DAEMON_PATTERN" > /dev/null; then
+  echo "$(date) - 常驻模式运行中，跳过本次执行" >> rss.log
+  deactivate
+  exit 0
+fi
+
 # 执行 Python 脚本，并将标准错误输出重定向到日志文件
 python3 rss.py 2>> "$LOG_FILE"
 
@@ -1,14 +1,17 @@
 import asyncio
 import aiohttp
 import logging
-import datetime
 import os
 import re
-import json
 from dotenv import load_dotenv
-from feedparser import parse
+from feed_state import FeedState, fetch_if_changed
+from parse_pool import parse_feed
 from telegram import Bot
 from telegram.constants import ParseMode
+from telegram_sender import send_queue
+from message_chunker import TELEGRAM_MAX_LENGTH, split_message
+from mmap_index import open_index
+from seen_keys import SeenKeys, seen_path
 
 # 加载 .env 文件
 load_dotenv()
@@ -72,37 +75,42 @@ ALLOWED_CHAT_IDS = os.getenv("ALLOWED_CHAT_IDS", "").split(",")
 # 文件路径配置
 SENT_RSS_FILE = "rss.json"
 SENT_YOUTUBE_FILE = "youtube.json"
+FEED_STATE_FILE = "rss22_feed_state.json"
+MAX_ENTRIES_TO_KEEP = 100000  # 每条只占 8 字节，保留足够长的历史
+
+# 条件请求缓存（ETag / Last-Modified / 内容哈希）
+feed_state = FeedState(FEED_STATE_FILE)
 
 
 async def fetch_feed(session, feed_url):
     try:
-        async with session.get(feed_url, timeout=88) as response:
-            response.raise_for_status()
-            content = await response.read()
-            parsed_feed = parse(content)
-            feed_title = parsed_feed.feed.get('title', '未命名来源')  # 获取 RSS 名称
-            return parsed_feed, feed_title
+        content = await fetch_if_changed(session, feed_url, feed_state, timeout=88)
+        if content is None:
+            return None, None
+        parsed_feed = await parse_feed(content)
+        feed_title = parsed_feed.feed.get('title', '未命名来源')  # 获取 RSS 名称
+        return parsed_feed, feed_title
     except Exception as e:
         logging.error(f"Error fetching {feed_url}: {e}")
         return None, None
 
 
-async def send_message(bot, chat_id, text, chunk_size=4096):
-    for i in range(0, len(text), chunk_size):
-        chunk = text[i:i + chunk_size]
+async def send_message(bot, chat_id, text, chunk_size=TELEGRAM_MAX_LENGTH):
+    # 按 UTF-16 长度切分，不会拆开 HTML 标签和字符实体
+    for chunk in split_message(text, chunk_size, parse_mode='HTML'):
         try:
             # 使用 HTML 格式推送消息
-            await bot.send_message(chat_id=chat_id, text=chunk, parse_mode=ParseMode.HTML)
+            await send_queue.send_message(bot, chat_id, chunk, parse_mode=ParseMode.HTML)
         except Exception as e:
             logging.error(f"Failed to send HTML message: {e}. Retrying with plain text.")
             try:
                 # 回退到原文推送
-                await bot.send_message(chat_id=chat_id, text=chunk)
+                await send_queue.send_message(bot, chat_id, chunk)
             except Exception as e:
                 logging.error(f"Failed to send fallback plain text message: {e}")
 
 
-async def process_feed(session, feed_url, sent_entries, bot, allowed_chat_ids, file_path):
+async def process_feed(session, feed_url, sent_entries, bot, allowed_chat_ids):
     feed_data, feed_title = await fetch_feed(session, feed_url)
     if feed_data is None or feed_title is None:
         return []
@@ -120,77 +128,58 @@ async def process_feed(session, feed_url, sent_entries, bot, allowed_chat_ids, f
             # 修改正则表达式以保留标点符号
             subject = re.sub(r'[^\w\s\u4e00-\u9fa5.,!?;:"\'()\-]+', '', subject)
 
-        message_id = f"{subject}_{url}" if subject and url else None
+        key = url or subject
+        if not key:
+            continue
 
-        if (url, subject, message_id) not in sent_entries:
+        if key not in sent_entries:
             message = f"{feed_title}\n<b>{subject}</b>\n{url}"
             messages.append(message)
-            new_entries.append((url, subject, message_id))
-
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            await save_sent_entry_to_file(
-                file_path,
-                url if url else current_time,
-                subject if subject else current_time,
-                message_id if message_id else current_time
-            )
-            sent_entries.add((url, subject, message_id))
+            new_entries.append(key)
+            sent_entries.add(key)
 
     if messages:
         combined_message = "\n\n".join(messages)  # 使用换行符拼接消息
         for chat_id in allowed_chat_ids:
             await send_message(bot, chat_id, combined_message)
-        await asyncio.sleep(6)
 
+    feed_state.commit(feed_url)
     return new_entries
 
 
-def load_sent_entries_from_file(file_path):
-    try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return {(entry['url'], entry['subject'], entry['message_id']) for entry in data}
-        else:
-            return set()
-    except Exception as e:
-        logging.error(f"Error loading sent entries from {file_path}: {e}")
-        return set()
-
-
-async def save_sent_entry_to_file(file_path, url, subject, message_id):
-    try:
-        sent_entries = load_sent_entries_from_file(file_path)
-        sent_entries.add((url, subject, message_id))
-        
-        data_to_save = []
-        for entry in sent_entries:
-            data_to_save.append({'url': entry[0], 'subject': entry[1], 'message_id': entry[2]})
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logging.error(f"Error saving entry to {file_path}: {e}")
+# 已发送条目以 64 位摘要保存，旧版 rss.json / youtube.json 在首次运行时迁移到同名 .seen 文件
+# MMAP_INDEX=1 时改用同名 .idx 索引文件
+def load_sent_entries(file_path):
+    index = open_index(file_path, MAX_ENTRIES_TO_KEEP)
+    if index is not None:
+        return index
+    return SeenKeys(seen_path(file_path), MAX_ENTRIES_TO_KEEP, legacy_path=file_path)
 
 
 async def main():
-    sent_entries = load_sent_entries_from_file(SENT_RSS_FILE)
-    sent_entries_second = load_sent_entries_from_file(SENT_YOUTUBE_FILE)
-
-    async with aiohttp.ClientSession() as session:
-        bot = Bot(token=RSS_HAOYAN)
-        second_bot = Bot(token=YOUTUBE_RSS)
-
-        tasks = [
-            process_feed(session, feed, sent_entries, bot, ALLOWED_CHAT_IDS, SENT_RSS_FILE)
-            for feed in RSS_FEEDS
-        ]
-        tasks += [
-            process_feed(session, feed, sent_entries_second, second_bot, ALLOWED_CHAT_IDS, SENT_YOUTUBE_FILE)
-            for feed in SECOND_RSS_FEEDS
-        ]
-
-        await asyncio.gather(*tasks)
+    sent_entries = load_sent_entries(SENT_RSS_FILE)
+    sent_entries_second = load_sent_entries(SENT_YOUTUBE_FILE)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            bot = Bot(token=RSS_HAOYAN)
+            second_bot = Bot(token=YOUTUBE_RSS)
+
+            tasks = [
+                process_feed(session, feed, sent_entries, bot, ALLOWED_CHAT_IDS)
+                for feed in RSS_FEEDS
+            ]
+            tasks += [
+                process_feed(session, feed, sent_entries_second, second_bot, ALLOWED_CHAT_IDS)
+                for feed in SECOND_RSS_FEEDS
+            ]
+
+            await asyncio.gather(*tasks)
+
+        feed_state.save()
+    finally:
+        sent_entries.close()
+        sent_entries_second.close()
 
 
 if __name__ == "__main__":
@@ -1,17 +1,19 @@
 import asyncio
 import aiohttp
 import logging
-import re
 import os
-import feedparser
 import json
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from feed_state import FeedState, fetch_if_changed
+from mmap_index import open_index
+from parse_pool import parse_feed
+from sanitizers import escape_markdown
 from telegram import Bot
-from tencentcloud.common import credential
-from tencentcloud.common.profile.client_profile import ClientProfile
-from tencentcloud.common.profile.http_profile import HttpProfile
-from tencentcloud.tmt.v20180321 import tmt_client, models
+from telegram_sender import send_queue
+from message_chunker import split_message
+from translator import TencentTranslator
 
 # 配置加载
 load_dotenv()
@@ -19,10 +21,11 @@ load_dotenv()
 # 异步安全配置
 MAX_CONCURRENT_REQUESTS = 5
 SENT_ENTRIES_FILE = "rss.json"
+FEED_STATE_FILE = "bbc_feed_state.json"
+INDEX_FILE = "bbc_sent.idx"  # MMAP_INDEX=1 时使用的索引文件
 RETENTION_DAYS = 15  # 15天历史记录保留
 MAX_HISTORY_ENTRIES = 1000  # 内存最大保留1500条
 REQUEST_TIMEOUT = 30
-TELEGRAM_DELAY = 0.3
 
 # RSS源配置
 RSS_FEEDS = [
@@ -54,29 +57,37 @@ logging.basicConfig(
 
 class AsyncRSSBot:
     def __init__(self):
-        self.sent_entries = []  # 存储格式：{'id': str, 'timestamp': float}
-        self.lock = asyncio.Lock()
+        # 已发送条目：id -> timestamp，按发送顺序排列，查询/插入均为 O(1)
+        self.sent_entries = OrderedDict()
+        self.index = None  # 启用 mmap 索引时代替 sent_entries
         self.bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        self.translate_client = None
+        self.translator = TencentTranslator(TENCENTCLOUD_SECRET_ID, TENCENTCLOUD_SECRET_KEY)
         self.session = None
+        self.feed_state = FeedState(FEED_STATE_FILE)
 
     async def initialize(self):
         self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
         await self.load_history()
-        self.init_translate_client()
-
-    def init_translate_client(self):
-        cred = credential.Credential(TENCENTCLOUD_SECRET_ID, TENCENTCLOUD_SECRET_KEY)
-        http_profile = HttpProfile(endpoint="tmt.tencentcloudapi.com")
-        client_profile = ClientProfile(httpProfile=http_profile)
-        self.translate_client = tmt_client.TmtClient(cred, "na-siliconvalley", client_profile)
 
     async def cleanup(self):
         await self.session.close()
         await self.save_history()
+        self.feed_state.save()
+        self.translator.close()
 
     async def load_history(self):
         """加载历史记录并执行数据清理"""
+        # 索引按写入时间判断是否过期，超过数量上限时自动淘汰最旧的条目
+        self.index = open_index(
+            SENT_ENTRIES_FILE,
+            MAX_HISTORY_ENTRIES,
+            max_age=RETENTION_DAYS * 86400,
+            file_path=INDEX_FILE,
+            legacy_paths=(SENT_ENTRIES_FILE,)
+        )
+        if self.index is not None:
+            logging.info(f"Opened {INDEX_FILE} with {len(self.index)} entries")
+            return
         try:
             if os.path.exists(SENT_ENTRIES_FILE):
                 with open(SENT_ENTRIES_FILE, 'r') as f:
@@ -98,109 +109,84 @@ class AsyncRSSBot:
                         if e['timestamp'] >= cutoff
                     ][-MAX_HISTORY_ENTRIES:]  # 先时间过滤，再数量限制
                     
-                    async with self.lock:
-                        self.sent_entries = valid_entries
+                    self.sent_entries = OrderedDict((e['id'], e['timestamp']) for e in valid_entries)
                     
-                    logging.info(f"Loaded {len(valid_entries)} entries (last {RETENTION_DAYS} days & max {MAX_HISTORY_ENTRIES} items)")
+                    logging.info(f"Loaded {len(self.sent_entries)} entries (last {RETENTION_DAYS} days & max {MAX_HISTORY_ENTRIES} items)")
         except Exception as e:
             logging.error(f"Error loading history: {str(e)}")
 
     async def save_history(self):
         """保存历史记录并执行清理"""
+        if self.index is not None:
+            self.index.close()
+            return
         try:
-            async with self.lock:
-                # 双重清理策略
-                cutoff = datetime.now().timestamp() - RETENTION_DAYS * 86400
-                valid_entries = [
-                    e for e in self.sent_entries
-                    if e['timestamp'] >= cutoff
-                ][-MAX_HISTORY_ENTRIES:]  # 先按时间过滤，再按数量限制
-                
-                with open(SENT_ENTRIES_FILE, 'w') as f:
-                    json.dump(valid_entries, f, indent=2)
-                
-                # 更新内存中的记录
-                self.sent_entries = valid_entries
+            # 双重清理策略：先按时间过滤，再按数量限制
+            self.expire_history()
+            valid_entries = [
+                {'id': entry_id, 'timestamp': timestamp}
+                for entry_id, timestamp in self.sent_entries.items()
+            ]
+            
+            with open(SENT_ENTRIES_FILE, 'w') as f:
+                json.dump(valid_entries, f, indent=2)
             
             logging.info(f"Saved {len(valid_entries)} entries (last {RETENTION_DAYS} days & max {MAX_HISTORY_ENTRIES} items)")
         except Exception as e:
             logging.error(f"Error saving history: {str(e)}")
 
-    def sanitize_markdown(self, text):
-        text = re.sub(r'<[^>]*>', '', text)
-        return re.sub(r'([*_`|#\\[\\](){}<>~+\-=!@%^&])', r'\\\1', text)
-
-    async def translate_text(self, text):
+    async def translate_texts(self, texts):
         try:
-            req = models.TextTranslateRequest()
-            req.SourceText = text
-            req.Source = "auto"
-            req.Target = "zh"
-            req.ProjectId = 0
-            resp = self.translate_client.TextTranslate(req)
-            return resp.TargetText
+            return await self.translator.translate_batch(texts)
         except Exception as e:
             logging.error(f"Translation error: {str(e)}")
-            return text
+            return list(texts)
 
     async def safe_send_message(self, chat_id, message):
-        max_length = 4096
-        chunks = [message[i:i+max_length] for i in range(0, len(message), max_length)]
-        
-        for chunk in chunks:
-            for attempt in range(3):
-                try:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text=chunk,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-                    await asyncio.sleep(TELEGRAM_DELAY)
-                    break
-                except Exception as e:
-                    logging.warning(f"Attempt {attempt+1} failed: {str(e)}")
-                    if attempt == 2:
-                        raise
-                    await asyncio.sleep(2 ** attempt)
-
-    async def process_entry(self, entry, source_name):
-        entry_id = entry.get('link') or entry.get('id')
-        if not entry_id:
-            logging.warning("Entry missing ID, skipping")
-            return False
+        # 按 UTF-16 长度切分，不会拆开标题加粗和来源链接
+        for chunk in split_message(message, parse_mode='Markdown'):
+            # 限速、429 和网络错误重试由发送调度统一处理，最终失败时抛出
+            await send_queue.send_message(
+                self.bot,
+                chat_id,
+                chunk,
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
 
-        # 检查是否已存在
-        async with self.lock:
-            existing_ids = {e['id'] for e in self.sent_entries}
-            if entry_id in existing_ids:
-                return False
+    def expire_history(self):
+        """从最旧的一端淘汰过期或超出数量上限的条目（均摊 O(1)）"""
+        cutoff = datetime.now().timestamp() - RETENTION_DAYS * 86400
+        while self.sent_entries:
+            oldest_timestamp = next(iter(self.sent_entries.values()))
+            if oldest_timestamp >= cutoff and len(self.sent_entries) <= MAX_HISTORY_ENTRIES:
+                break
+            self.sent_entries.popitem(last=False)
+
+    def is_sent(self, entry_id):
+        if self.index is not None:
+            return entry_id in self.index
+        return entry_id in self.sent_entries
+
+    def mark_sent(self, entry_id):
+        if self.index is not None:
+            self.index.add(entry_id)
+            return
+        self.sent_entries[entry_id] = datetime.now().timestamp()
+        self.sent_entries.move_to_end(entry_id)
+        self.expire_history()
+
+    async def process_entry(self, entry_id, translated_title, translated_summary, source_name):
+        # 翻译期间其他源可能已发送同一条目
+        if self.is_sent(entry_id):
+            return False
 
-        title = self.sanitize_markdown(entry.get('title', 'Untitled'))
-        summary = self.sanitize_markdown(entry.get('summary', 'No summary'))
-        
-        # 并行翻译
-        translated_title, translated_summary = await asyncio.gather(
-            self.translate_text(title),
-            self.translate_text(summary)
-        )
-        
         message = f"*{translated_title}*\n{translated_summary}\n[{source_name}]({entry_id})"
         
         try:
             await self.safe_send_message(TELEGRAM_CHAT_ID, message)
-            async with self.lock:
-                # 添加新条目并执行内存清理
-                self.sent_entries.append({
-                    'id': entry_id,
-                    'timestamp': datetime.now().timestamp()
-                })
-                # 实时维护内存数据
-                cutoff = datetime.now().timestamp() - RETENTION_DAYS * 86400
-                self.sent_entries = [
-                    e for e in self.sent_entries
-                    if e['timestamp'] >= cutoff
-                ][-MAX_HISTORY_ENTRIES:]
+            # 添加新条目并执行内存清理
+            self.mark_sent(entry_id)
             return True
         except Exception as e:
             logging.error(f"Failed to send message: {str(e)}")
@@ -209,9 +195,10 @@ class AsyncRSSBot:
     async def fetch_feed(self, feed_url):
         headers = {'User-Agent': 'Mozilla/5.0'}
         try:
-            async with self.session.get(feed_url, headers=headers) as response:
-                content = await response.text()
-                return feedparser.parse(content)
+            content = await fetch_if_changed(self.session, feed_url, self.feed_state, headers=headers)
+            if content is None:
+                return None
+            return await parse_feed(content)
         except Exception as e:
             logging.error(f"Failed to fetch {feed_url}: {str(e)}")
             return None
@@ -222,11 +209,35 @@ class AsyncRSSBot:
             return 0
         
         source_name = feed.feed.get('title', feed_url)
-        count = 0
-        
+        pending = []
+
         for entry in reversed(feed.entries):
-            if await self.process_entry(entry, source_name):
+            entry_id = entry.get('link') or entry.get('id')
+            if not entry_id:
+                logging.warning("Entry missing ID, skipping")
+                continue
+            if self.is_sent(entry_id):
+                continue
+            title = escape_markdown(entry.get('title', 'Untitled'))
+            summary = escape_markdown(entry.get('summary', 'No summary'))
+            pending.append((entry_id, title, summary))
+
+        if not pending:
+            self.feed_state.commit(feed_url)
+            return 0
+
+        # 整个源的标题和简介合并为一次批量翻译
+        translated = await self.translate_texts(
+            [text for _, title, summary in pending for text in (title, summary)]
+        )
+
+        count = 0
+        for i, (entry_id, _, _) in enumerate(pending):
+            if await self.process_entry(entry_id, translated[2 * i], translated[2 * i + 1], source_name):
                 count += 1
+        # 有条目发送失败时不保存校验信息，下次完整抓取并重试
+        if all(self.is_sent(entry_id) for entry_id, _, _ in pending):
+            self.feed_state.commit(feed_url)
         return count
 
     async def run(self):
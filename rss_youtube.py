@@ -2,14 +2,17 @@ import asyncio
 import aiohttp
 import logging
 import os
-import re
-import json
-import html
+from contextlib import closing
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from feedparser import parse
+from bloom_filter import SentUrlHistory
+from mmap_index import open_index
+from feed_state import FeedState, fetch_if_changed, iter_new_entries
+from parse_pool import parse_feed
+from sanitizers import clean_title
 from telegram import Bot
 from telegram.constants import ParseMode
+from telegram_sender import send_queue
 
 # 加载环境变量
 load_dotenv()
@@ -17,11 +20,11 @@ load_dotenv()
 # 配置参数
 CONNECTION_POOL_SIZE = 20
 REQUEST_TIMEOUT = 30
-SEND_INTERVAL = 0.7
 MAX_CONCURRENT_TASKS = 10
 MAX_ENTRIES_PER_FEED = 20
 HOURS_LIMIT = 24
 STORAGE_FILE = "youtube.json"
+FEED_STATE_FILE = "youtube_feed_state.json"
 
 RSS_FEEDS = [
    # 'https://www.youtube.com/feeds/videos.xml?channel_id=UCvijahEyGtvMpmMHBu4FS2w', # 零度解说
@@ -77,11 +80,8 @@ SECOND_RSS_FEEDS = [
     'https://www.youtube.com/feeds/videos.xml?channel_id=UCHW6W9g2TJL2_Lf7GfoI5kg', # 电影放映厅
 ]
 
-def clean_text(text):
-    """清理文本并转义HTML字符"""
-    text = re.sub(r'<\/?b>', '', text)  # 移除残留HTML标签
-    text = re.sub(r'[^\w\s\u4e00-\u9fa5.,!?;:"\'()\-]+', '', text)
-    return html.escape(text)  # 转义HTML特殊字符
+# 条件请求缓存（ETag / Last-Modified / 内容哈希）
+feed_state = FeedState(FEED_STATE_FILE)
 
 async def create_session():
     return aiohttp.ClientSession(
@@ -95,31 +95,35 @@ async def create_session():
 
 async def fetch_feed(session, feed_url):
     try:
-        async with session.get(feed_url) as response:
-            response.raise_for_status()
-            return parse(await response.read())
+        content = await fetch_if_changed(session, feed_url, feed_state)
+        if content is None:
+            return None
+        return await parse_feed(content)
     except Exception as e:
         logging.error(f"抓取失败 {feed_url}: {e}")
         return None
 
 async def send_message(bot, chat_id, text):
+    """发送成功（含纯文本回退）时返回 True"""
     try:
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
+        # 限速与 429 重试由发送调度统一处理
+        await send_queue.send_message(
+            bot,
+            chat_id,
+            text,
             parse_mode=ParseMode.HTML,
             disable_web_page_preview=False
         )
-        await asyncio.sleep(SEND_INTERVAL)
+        return True
     except Exception as e:
         logging.error(f"消息发送失败: {e}")
-        for retry in range(3):
-            try:
-                await asyncio.sleep(2 ** retry)
-                await bot.send_message(chat_id=chat_id, text=text)
-                return
-            except Exception:
-                continue
+        try:
+            # 回退到纯文本推送
+            await send_queue.send_message(bot, chat_id, text)
+            return True
+        except Exception as e:
+            logging.error(f"纯文本发送失败: {e}")
+            return False
 
 def within_time_limit(entry):
     time_fields = ['published_parsed', 'updated_parsed', 'created_parsed']
@@ -139,32 +143,43 @@ async def process_feed(session, feed_url, bot, chat_ids, sent_urls):
             return
 
         raw_feed_title = feed_data.feed.get('title', '未命名来源')
-        feed_title = clean_text(raw_feed_title)  # 清理频道名称
+        feed_title = clean_title(raw_feed_title)  # 清理频道名称
         new_entries = []
-        processed_count = 0
+        processed = []
+        batch_urls = set()
 
-        for entry in feed_data.entries:
-            if processed_count >= MAX_ENTRIES_PER_FEED:
-                break
+        def is_seen(entry):
+            url = entry.get('link', '')
+            return not url or url in sent_urls or url in batch_urls or not within_time_limit(entry)
 
-            if not within_time_limit(entry):
-                continue
+        # 条目按时间倒序，遇到已发送或过期的条目即可提前结束
+        with closing(iter_new_entries(feed_data.entries, feed_url, feed_state, is_seen)) as entries:
+            for entry in entries:
+                if len(processed) >= MAX_ENTRIES_PER_FEED:
+                    break
 
-            url = entry.get('link', '')
-            if url and url not in sent_urls:
+                url = entry.get('link', '')
                 raw_title = entry.get('title', '无标题')
-                clean_title = clean_text(raw_title)  # 清理并转义标题
-                
+                title = clean_title(raw_title)  # 清理并转义标题
+
                 # 使用HTML加粗标签
-                new_entries.append(f"<b>{clean_title}</b>\n{url}")
-                sent_urls.add(url)
-                processed_count += 1
+                new_entries.append(f"<b>{title}</b>\n{url}")
+                processed.append(entry)
+                batch_urls.add(url)
 
         if new_entries:
             message = f"{feed_title}\n\n" + "\n\n".join(new_entries)
+            delivered = False
             for chat_id in chat_ids:
-                await send_message(bot, chat_id, message)
-            await save_sent_urls(sent_urls)
+                delivered = await send_message(bot, chat_id, message) or delivered
+            if not delivered:
+                # 未记录为已发送，下一轮重试
+                return
+            for entry in processed:
+                sent_urls.add(entry.get('link', ''))
+                feed_state.mark_processed(feed_url, entry)
+        # 已发送记录在本轮（常驻模式下为本次任务）结束时统一写回，先于 feed_state 保存
+        feed_state.commit(feed_url)
 
     except Exception as e:
         logging.error(f"处理源失败 {feed_url}: {e}")
@@ -191,23 +206,22 @@ async def main():
 
         await asyncio.gather(*tasks)
         await save_sent_urls(sent_urls)
+        feed_state.save()
         
     finally:
         await session.close()
 
 async def load_sent_urls():
-    try:
-        if os.path.exists(STORAGE_FILE):
-            with open(STORAGE_FILE, 'r') as f:
-                return set(json.load(f))
-    except Exception as e:
-        logging.error(f"加载失败 {STORAGE_FILE}: {e}")
-    return set()
+    # 最近窗口精确保存在 JSON 中，更早的历史由同名 .bloom 过滤器判断
+    # MMAP_INDEX=1 时改用同名 .idx 索引文件
+    index = open_index(STORAGE_FILE)
+    if index is not None:
+        return index
+    return SentUrlHistory(STORAGE_FILE)
 
 async def save_sent_urls(urls):
     try:
-        with open(STORAGE_FILE, 'w') as f:
-            json.dump(list(urls), f)
+        urls.save()
     except Exception as e:
         logging.error(f"保存失败 {STORAGE_FILE}: {e}")
 
@@ -2,13 +2,15 @@ import asyncio
 import aiohttp
 import logging
 import os
-import re
-import json
-import html
 from dotenv import load_dotenv
-from feedparser import parse
+from bloom_filter import SentUrlHistory
+from mmap_index import open_index
+from feed_state import FeedState, fetch_if_changed
+from parse_pool import parse_feed
+from sanitizers import clean_title, escape_html
 from telegram import Bot
 from telegram.constants import ParseMode
+from telegram_sender import send_queue
 
 # 加载环境变量
 load_dotenv()
@@ -16,8 +18,8 @@ load_dotenv()
 # 配置参数
 CONNECTION_POOL_SIZE = 10
 REQUEST_TIMEOUT = 30
-SEND_INTERVAL = 0.7
 MAX_CONCURRENT_TASKS = 10
+FEED_STATE_FILE = "deepseek_feed_state.json"
 
 # RSS 源列表
 RSS_FEEDS = [
@@ -68,6 +70,9 @@ SECOND_RSS_FEEDS = [
     'https://www.youtube.com/feeds/videos.xml?channel_id=UCHW6W9g2TJL2_Lf7GfoI5kg', # 电影放映厅
 ]
 
+# 条件请求缓存（ETag / Last-Modified / 内容哈希）
+feed_state = FeedState(FEED_STATE_FILE)
+
 async def create_session():
     return aiohttp.ClientSession(
         connector=aiohttp.TCPConnector(
@@ -80,60 +85,73 @@ async def create_session():
 
 async def fetch_feed(session, feed_url):
     try:
-        async with session.get(feed_url) as response:
-            response.raise_for_status()
-            return parse(await response.read())
+        content = await fetch_if_changed(session, feed_url, feed_state)
+        if content is None:
+            return None
+        return await parse_feed(content)
     except Exception as e:
         logging.error(f"抓取失败 {feed_url}: {e}")
         return None
 
 async def send_message(bot, chat_id, text):
+    """发送成功（含纯文本回退）返回 True"""
     try:
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
+        # 限速与 429 重试由发送调度统一处理
+        await send_queue.send_message(
+            bot,
+            chat_id,
+            text,
             parse_mode=ParseMode.HTML,
             disable_web_page_preview=False
         )
-        await asyncio.sleep(SEND_INTERVAL)
+        return True
     except Exception as e:
         logging.error(f"消息发送失败: {e}")
-        for retry in range(3):
-            try:
-                await asyncio.sleep(2 ** retry)
-                await bot.send_message(chat_id=chat_id, text=text)
-                return
-            except Exception:
-                continue
-
-async def process_feed(session, feed_url, bot, chat_ids, sent_urls, filename):
+        try:
+            # 回退到纯文本推送
+            await send_queue.send_message(bot, chat_id, text)
+            return True
+        except Exception as e:
+            logging.error(f"纯文本发送失败: {e}")
+            return False
+
+async def process_feed(session, feed_url, bot, chat_ids, sent_urls):
     try:
         feed_data = await fetch_feed(session, feed_url)
         if not feed_data or not hasattr(feed_data, 'feed'):
             return
 
-        feed_title = html.escape(feed_data.feed.get('title', '未命名来源'))
+        feed_title = escape_html(feed_data.feed.get('title', '未命名来源'))
         new_entries = []
+        new_urls = []
 
         for entry in feed_data.entries:
             url = entry.get('link', '')
-            if url and url not in sent_urls:
-                title = html.escape(entry.get('title', '无标题'))
-                title = re.sub(r'[^\w\s\u4e00-\u9fa5.,!?;:"\'()\-]+', '', title)
+            if url and url not in sent_urls and url not in new_urls:
+                # 先过滤符号再转义，避免 &amp; 之类的实体被过滤成 amp
+                title = clean_title(entry.get('title', '无标题'))
                 new_entries.append(f"<b>{title}</b>\n{url}")
-                sent_urls.add(url)
+                new_urls.append(url)
 
         if new_entries:
             message = f"【{feed_title}】更新\n\n" + "\n\n".join(new_entries)
+            delivered = False
             for chat_id in chat_ids:
-                await send_message(bot, chat_id, message)
-            await save_sent_urls(filename, sent_urls)
+                delivered = await send_message(bot, chat_id, message) or delivered
+            if not delivered:
+                # 不记录为已发送、不保存校验信息，下一轮重新抓取并重试
+                return
+            for url in new_urls:
+                sent_urls.add(url)
+        feed_state.commit(feed_url)
 
     except Exception as e:
         logging.error(f"处理源失败 {feed_url}: {e}")
 
 async def main():
     session = await create_session()
+    # 每个文件只加载一次，由同组所有源共享；本轮结束后统一原子写回
+    stores = {}
     try:
         bot = Bot(os.getenv("RSS_TOKEN"))
         second_bot = Bot(os.getenv("YOUTUBE_RSS"))
@@ -141,37 +159,39 @@ async def main():
 
         semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
         
-        async def limited_task(feed_url, target_bot, filename):
+        async def limited_task(feed_url, target_bot, sent_urls):
             async with semaphore:
-                sent_urls = await load_sent_urls(filename)
-                await process_feed(session, feed_url, target_bot, chat_ids, sent_urls, filename)
+                await process_feed(session, feed_url, target_bot, chat_ids, sent_urls)
 
         tasks = []
         for feed_group, target_bot, filename in [
             (RSS_FEEDS, bot, "youtube.json"),
             (SECOND_RSS_FEEDS, second_bot, "youtube1.json")
         ]:
+            if filename not in stores:
+                stores[filename] = await load_sent_urls(filename)
             for feed_url in feed_group:
-                tasks.append(limited_task(feed_url, target_bot, filename))
+                tasks.append(limited_task(feed_url, target_bot, stores[filename]))
 
         await asyncio.gather(*tasks)
+        feed_state.save()
         
     finally:
+        for filename, sent_urls in stores.items():
+            await save_sent_urls(filename, sent_urls)
         await session.close()
 
 async def load_sent_urls(filename):
-    try:
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                return set(json.load(f))
-    except Exception as e:
-        logging.error(f"加载失败 {filename}: {e}")
-    return set()
+    # 最近窗口精确保存在 JSON 中，更早的历史由同名 .bloom 过滤器判断
+    # MMAP_INDEX=1 时改用同名 .idx 索引文件
+    index = open_index(filename)
+    if index is not None:
+        return index
+    return SentUrlHistory(filename)
 
 async def save_sent_urls(filename, urls):
     try:
-        with open(filename, 'w') as f:
-            json.dump(list(urls), f)
+        urls.save()
     except Exception as e:
         logging.error(f"保存失败 {filename}: {e}")
 
@@ -0,0 +1,325 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+SEEN_MAGIC = b'SEENKEY2'  # 文件头为魔数和 8 字节小端保留上限，其后是按写入顺序排列的 8 字节小端摘要
+SEEN_MAGIC_V1 = b'SEENKEY1'  # 旧版文件头，没有保留上限
+SEEN_HEADER = struct.Struct('<8sQ')
+SEEN_FSYNC_EVERY = 20  # 每追加多少条记录执行一次 fsync
+SEEN_COMPACT_FACTOR = 2  # 文件记录数超过保留上限的倍数时触发压缩
+
+
+def normalize_key(text):
+    """链接去掉协议差异、主机大小写、结尾斜杠和锚点；非链接只去掉首尾空白"""
+    text = text.strip()
+    parts = urlsplit(text)
+    if parts.scheme in ('http', 'https') and parts.netloc:
+        return urlunsplit(('https', parts.netloc.lower(), parts.path.rstrip('/') or '/', parts.query, ''))
+    return text
+
+
+def key_digest(text):
+    digest = hashlib.blake2b(normalize_key(text).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def read_legacy_keys(file_path):
+    """读取旧版去重文件中的链接（没有链接时用标题）
+
+    兼容 JSON 数组（元素为 [url, subject, message_id]、{'url', 'subject', ...}、{'id', 'timestamp'}
+    或链接字符串）
+    以及每行一条 [url, subject, message_id] 记录的 JSONL 追加日志（含末行写了一半的情况）。
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    try:
+        data = json.loads(content)
+        items = data if isinstance(data, list) else []
+        # 只有一行的追加日志本身就是一条 [url, subject, message_id] 记录，不是链接列表
+        if (len(items) == 3 and all(isinstance(value, str) for value in items)
+                and items[2] == f"{items[1]}_{items[0]}"):
+            items = [items]
+    except ValueError:
+        items = []
+        for line in content.splitlines():
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                continue
+
+    for item in items:
+        if isinstance(item, dict):
+            key = item.get('url') or item.get('subject') or item.get('id')
+        elif isinstance(item, list):
+            key = next((value for value in item if value), None)
+        else:
+            key = item
+        if isinstance(key, str) and key:
+            yield key
+
+
+def read_seen_file(file_path):
+    """读取摘要文件，返回 (按写入顺序排列的摘要, 文件头中的保留上限, 是否需要重写)
+
+    旧版 SEENKEY1 文件没有保留上限（返回 0）；进程中断时最后一条记录可能不完整，
+    会被丢弃。这两种情况都需要重写文件。格式无法识别时抛出 ValueError。
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data[:len(SEEN_MAGIC_V1)] == SEEN_MAGIC_V1:
+        bound = 0
+        body = data[len(SEEN_MAGIC_V1):]
+        rewrite = True
+    elif data[:len(SEEN_MAGIC)] == SEEN_MAGIC and len(data) >= SEEN_HEADER.size:
+        _, bound = SEEN_HEADER.unpack_from(data)
+        body = data[SEEN_HEADER.size:]
+        rewrite = False
+    else:
+        raise ValueError("unknown file format")
+    records = array('Q')
+    usable = len(body) - len(body) % records.itemsize
+    if usable != len(body):
+        rewrite = True
+    records.frombytes(body[:usable])
+    if sys.byteorder == 'big':
+        records.byteswap()
+    return records, bound, rewrite
+
+
+class SeenKeys:
+    """以 64 位摘要保存的已发送集合
+
+    每条记录只占 8 字节：内存中用 array('Q') 保存写入顺序，另有一份有序副本
+    用二分查找判断是否存在；文件只追加新摘要，超过上限后压缩为最近的记录。
+    首次运行时从 legacy_path 指向的旧版 JSON 文件迁移。
+    对外表现为以链接（或标题）字符串为元素的集合（支持 in / add / len）。
+
+    多个进程可以共用同一个文件（如 rss.py 和 rss22.py 共用 rss.seen）：
+    文件头记录各进程中最大的保留上限，压缩时按它保留；追加和压缩都在 .lock 文件的
+    排他锁下进行，压缩前重新读取文件，合并其他进程追加的记录；文件被其他进程替换后
+    追加前会重新打开。
+    """
+
+    def __init__(self, file_path, max_entries, legacy_path=None, fsync_every=SEEN_FSYNC_EVERY):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.bound = max_entries  # 实际保留上限：本进程配置与文件头中的较大者
+        self.fsync_every = fsync_every
+        self.recent = array('Q')
+        self.sorted = array('Q')
+        self.record_count = 0
+        self.unsynced = 0
+        self.needs_compact = False
+        self._file = None
+        self._lock_file = None
+        self.load(legacy_path)
+
+    @contextmanager
+    def _locked(self):
+        if self._lock_file is None:
+            self._lock_file = open(self.file_path + '.lock', 'a')
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def load(self, legacy_path=None):
+        records = array('Q')
+        if os.path.exists(self.file_path):
+            try:
+                with self._locked():
+                    records, bound, rewrite = read_seen_file(self.file_path)
+                    if bound < self.max_entries and not rewrite:
+                        # 让共用该文件的其他进程压缩时也保留本进程需要的条数
+                        with open(self.file_path, 'r+b') as f:
+                            f.write(SEEN_HEADER.pack(SEEN_MAGIC, self.max_entries))
+                self.bound = max(self.max_entries, bound)
+                self.needs_compact = rewrite
+                self.record_count = len(records)
+            except Exception as e:
+                logging.error(f"Error loading seen keys from {self.file_path}: {e}")
+                records = array('Q')
+        elif legacy_path and os.path.exists(legacy_path):
+            try:
+                digests = dict.fromkeys(key_digest(key) for key in read_legacy_keys(legacy_path))
+                records = array('Q', digests)
+                self.needs_compact = True
+                logging.info(f"Migrating {len(records)} entries from {legacy_path} to {self.file_path}")
+            except Exception as e:
+                logging.error(f"Error migrating {legacy_path}: {e}")
+
+        if len(records) > self.bound:
+            records = records[-self.bound:]
+        self.recent = records
+        self.sorted = array('Q', sorted(records))
+        if self.needs_compact:
+            self.compact()
+
+    def _contains_digest(self, digest):
+        index = bisect_left(self.sorted, digest)
+        return index < len(self.sorted) and self.sorted[index] == digest
+
+    def __contains__(self, key):
+        return self._contains_digest(key_digest(key))
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def add(self, key):
+        digest = key_digest(key)
+        if self._contains_digest(digest):
+            return
+        insort(self.sorted, digest)
+        self.recent.append(digest)
+
+        record = array('Q', [digest])
+        if sys.byteorder == 'big':
+            record.byteswap()
+        try:
+            with self._locked():
+                self._open_for_append()
+                # 无缓冲写入，释放锁之前记录已经在文件中，其他进程压缩时不会漏掉
+                self._file.write(record.tobytes())
+            self.record_count += 1
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every:
+                self.sync()
+        except Exception as e:
+            logging.error(f"Error appending seen key to {self.file_path}: {e}")
+
+        if self.record_count > self.bound * SEEN_COMPACT_FACTOR:
+            self.compact()
+
+    def sync(self):
+        if self._file is None or not self.unsynced:
+            return
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.unsynced = 0
+        except Exception as e:
+            logging.error(f"Error syncing {self.file_path}: {e}")
+
+    def _open_for_append(self):
+        """打开追加句柄；文件已被其他进程压缩替换（或删除）时重新打开，调用方需持有锁"""
+        if self._file is not None:
+            try:
+                stale = os.fstat(self._file.fileno()).st_ino != os.stat(self.file_path).st_ino
+            except FileNotFoundError:
+                stale = True
+            if stale:
+                self._close_file()
+        if self._file is None:
+            self._file = open(self.file_path, 'ab', buffering=0)
+            if self._file.tell() == 0:
+                self._file.write(SEEN_HEADER.pack(SEEN_MAGIC, self.bound))
+
+    def compact(self):
+        """只保留最近 bound 条，原子替换文件
+
+        在锁内重新读取文件，其他进程追加的记录按文件中的顺序保留，本进程写入了
+        已被替换的旧文件的记录补在最后；同一摘要只保留最近一次。
+        """
+        self._close_file()
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        try:
+            with self._locked():
+                records = array('Q')
+                if os.path.exists(self.file_path):
+                    try:
+                        records, bound, _ = read_seen_file(self.file_path)
+                        self.bound = max(self.bound, bound)
+                    except Exception as e:
+                        logging.error(f"Error re-reading {self.file_path} before compaction: {e}")
+                present = set(records)
+                records.extend(digest for digest in self.recent if digest not in present)
+                keep = array('Q', reversed(dict.fromkeys(reversed(records))))[-self.bound:]
+
+                data = array('Q', keep)
+                if sys.byteorder == 'big':
+                    data.byteswap()
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.seen')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(SEEN_HEADER.pack(SEEN_MAGIC, self.bound))
+                        f.write(data.tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, self.file_path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+            self.recent = keep
+            self.sorted = array('Q', sorted(keep))
+            self.record_count = len(keep)
+            self.needs_compact = False
+        except Exception as e:
+            logging.error(f"Error compacting {self.file_path}: {e}")
+
+    def close(self):
+        if self.needs_compact or self.record_count > self.bound * SEEN_COMPACT_FACTOR:
+            self.compact()
+        else:
+            self._close_file()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        self.sync()
+        try:
+            self._file.close()
+        except Exception as e:
+            logging.error(f"Error closing {self.file_path}: {e}")
+        self._file = None
+
+
+def seen_path(json_path):
+    """旧版 JSON 去重文件对应的摘要文件路径（rss.json -> rss.seen）"""
+    return os.path.splitext(json_path)[0] + '.seen'
+
+
+if __name__ == "__main__":
+    # 基准测试：与 (url, subject, message_id) 元组 + JSON 的体积和加载耗时对比
+    import time
+
+    count = 100000
+    directory = tempfile.mkdtemp()
+    legacy = os.path.join(directory, 'rss.json')
+    items = []
+    for i in range(count):
+        url = f"https://example.com/news/2024/{i:06d}.html"
+        subject = f"新闻标题 {i} Breaking news headline"
+        items.append({'url': url, 'subject': subject, 'message_id': f"{subject}_{url}"})
+    with open(legacy, 'w', encoding='utf-8') as f:
+        json.dump(items, f, ensure_ascii=False, indent=4)
+
+    start = time.perf_counter()
+    with open(legacy, 'r', encoding='utf-8') as f:
+        legacy_set = {(item['url'], item['subject'], item['message_id']) for item in json.load(f)}
+    legacy_time = time.perf_counter() - start
+
+    keys = SeenKeys(seen_path(legacy), count, legacy_path=legacy)
+    keys.close()
+    start = time.perf_counter()
+    keys = SeenKeys(seen_path(legacy), count)
+    seen_time = time.perf_counter() - start
+    assert all(item['url'] in keys for item in items[:1000])
+    assert "https://example.com/unknown" not in keys
+    keys.close()
+
+    print(f"legacy JSON: {os.path.getsize(legacy) / 1024:.0f} KiB, load {legacy_time * 1000:.1f} ms")
+    print(f"seen keys:   {os.path.getsize(seen_path(legacy)) / 1024:.0f} KiB, load {seen_time * 1000:.1f} ms")
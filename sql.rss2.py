@@ -6,9 +6,12 @@ import datetime
 import os
 import re
 from dotenv import load_dotenv
-from feedparser import parse
+from mysql_store import SentEntryBuffer, SentEntryIndex, ensure_dedup_schema, prune_sent_entries
+from parse_pool import parse_feed
 from telegram import Bot
 from telegram.constants import ParseMode
+from telegram_sender import send_queue
+from message_chunker import TELEGRAM_MAX_LENGTH, split_message
 import urllib.parse
 
 # 加载 .env 文件
@@ -90,60 +93,65 @@ async def fetch_feed(session, feed_url):
         async with session.get(feed_url, timeout=88) as response:
             response.raise_for_status()
             content = await response.read()
-            parsed_feed = parse(content)
-            feed_title = parsed_feed.feed.get('title', '未命名来源')  # 获取 RSS 名称
-            return parsed_feed, feed_title
+        # 连接先归还连接池，再交给解析池
+        parsed_feed = await parse_feed(content)
+        feed_title = parsed_feed.feed.get('title', '未命名来源')  # 获取 RSS 名称
+        return parsed_feed, feed_title
     except Exception as e:
         logging.error(f"Error fetching {feed_url}: {e}")
         return None, None
 
 
-async def send_message(bot, chat_id, text, chunk_size=4096):
-    for i in range(0, len(text), chunk_size):
-        chunk = text[i:i + chunk_size]
+async def send_message(bot, chat_id, text, chunk_size=TELEGRAM_MAX_LENGTH):
+    # 按 UTF-16 长度切分，不会拆开 HTML 标签和字符实体
+    for chunk in split_message(text, chunk_size, parse_mode='HTML'):
         try:
             # 使用 HTML 格式推送消息
-            await bot.send_message(chat_id=chat_id, text=chunk, parse_mode=ParseMode.HTML)
+            await send_queue.send_message(bot, chat_id, chunk, parse_mode=ParseMode.HTML)
         except Exception as e:
             logging.error(f"Failed to send HTML message: {e}. Retrying with plain text.")
             try:
                 # 回退到原文推送
-                await bot.send_message(chat_id=chat_id, text=chunk)
+                await send_queue.send_message(bot, chat_id, chunk)
             except Exception as e:
                 logging.error(f"Failed to send fallback plain text message: {e}")
 
-async def process_feed(session, feed_url, sent_entries, pool, bot, allowed_chat_ids, table_name):
+def entry_key(entry):
+    """去重键：(链接, 清理后的标题, 标题_链接)"""
+    subject = entry.title if entry.title else None
+    url = entry.link if entry.link else None
+
+    if subject:
+        # 添加来源名称到消息中并保留标点符号
+        subject = f"{subject}"
+        # 修改正则表达式以保留标点符号
+        subject = re.sub(r'[^\w\s\u4e00-\u9fa5.,!?;:"\'()\-]+', '', subject)
+
+    message_id = f"{subject}_{url}" if subject and url else None
+    return url, subject, message_id
+
+async def process_feed(session, feed_url, sent_entries, writer, bot, allowed_chat_ids):
     feed_data, feed_title = await fetch_feed(session, feed_url)
     if feed_data is None or feed_title is None:
         return []
 
     new_entries = []
     messages = []
+    keys = [entry_key(entry) for entry in feed_data.entries]
+    # 只向数据库查询本次抓取到的条目
+    await sent_entries.prefetch(keys)
 
-    for entry in feed_data.entries:
-        subject = entry.title if entry.title else None
-        url = entry.link if entry.link else None
-
-        if subject:
-            # 添加来源名称到消息中并保留标点符号
-            subject = f"{subject}"
-            # 修改正则表达式以保留标点符号
-            subject = re.sub(r'[^\w\s\u4e00-\u9fa5.,!?;:"\'()\-]+', '', subject)
-
-        message_id = f"{subject}_{url}" if subject and url else None
-
+    for url, subject, message_id in keys:
         if (url, subject, message_id) not in sent_entries:
             message = f"{feed_title}\n<b>{subject}</b>\n{url}"
             messages.append(message)
             new_entries.append((url, subject, message_id))
 
             current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            await save_sent_entry_to_db(
-                pool,
+            await writer.add(
                 url if url else current_time,
                 subject if subject else current_time,
-                message_id if message_id else current_time,
-                table_name
+                message_id if message_id else current_time
             )
             sent_entries.add((url, subject, message_id))
 
@@ -151,7 +159,6 @@ async def process_feed(session, feed_url, sent_entries, pool, bot, allowed_chat_
         combined_message = "\n\n".join(messages)  # 使用换行符拼接消息
         for chat_id in allowed_chat_ids:
             await send_message(bot, chat_id, combined_message)
-        await asyncio.sleep(6)
 
     return new_entries
 
@@ -162,53 +169,45 @@ async def connect_to_db_pool():
         logging.error(f"Database connection error: {e}")
         return None
 
-async def load_sent_entries_from_db(pool, table_name):
-    try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(f"SELECT url, subject, message_id FROM {table_name}")
-                rows = await cursor.fetchall()
-                return {(row[0], row[1], row[2]) for row in rows}
-    except Exception as e:
-        logging.error(f"Error loading sent entries: {e}")
-        return set()
-
-async def save_sent_entry_to_db(pool, url, subject, message_id, table_name):
-    try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    f"INSERT IGNORE INTO {table_name} (url, subject, message_id) VALUES (%s, %s, %s)",
-                    (url, subject, message_id)
-                )
-                await conn.commit()
-    except Exception as e:
-        logging.error(f"Error saving entry: {e}")
-
 async def main():
     pool = await connect_to_db_pool()
     if not pool:
         logging.error("Failed to connect to the database.")
         return
 
-    sent_entries = await load_sent_entries_from_db(pool, "sent_rss")
-    sent_entries_second = await load_sent_entries_from_db(pool, "sent_youtube")
+    # 不再整表加载已发送记录，按本次抓取到的条目哈希查询
+    hashed = await ensure_dedup_schema(pool, "sent_rss")
+    hashed_second = await ensure_dedup_schema(pool, "sent_youtube")
+    sent_entries = SentEntryIndex(pool, "sent_rss", hashed)
+    sent_entries_second = SentEntryIndex(pool, "sent_youtube", hashed_second)
 
-    async with aiohttp.ClientSession() as session:
-        bot = Bot(token=RSS_HAOYAN)
-        second_bot = Bot(token=YOUTUBE_RSS)
-
-        tasks = [
-            process_feed(session, feed, sent_entries, pool, bot, ALLOWED_CHAT_IDS, "sent_rss")
-            for feed in RSS_FEEDS
-        ]
-        tasks += [
-            process_feed(session, feed, sent_entries_second, pool, second_bot, ALLOWED_CHAT_IDS, "sent_youtube")
-            for feed in SECOND_RSS_FEEDS
-        ]
-
-        await asyncio.gather(*tasks)
+    # 写缓冲：按批次合并写库，每张表一个
+    writer = SentEntryBuffer(pool, "sent_rss", hashed)
+    second_writer = SentEntryBuffer(pool, "sent_youtube", hashed_second)
 
+    try:
+        async with aiohttp.ClientSession() as session:
+            bot = Bot(token=RSS_HAOYAN)
+            second_bot = Bot(token=YOUTUBE_RSS)
+
+            tasks = [
+                process_feed(session, feed, sent_entries, writer, bot, ALLOWED_CHAT_IDS)
+                for feed in RSS_FEEDS
+            ]
+            tasks += [
+                process_feed(session, feed, sent_entries_second, second_writer, second_bot, ALLOWED_CHAT_IDS)
+                for feed in SECOND_RSS_FEEDS
+            ]
+
+            await asyncio.gather(*tasks)
+    finally:
+        await writer.close()
+        await second_writer.close()
+
+    if hashed:
+        await prune_sent_entries(pool, "sent_rss")
+    if hashed_second:
+        await prune_sent_entries(pool, "sent_youtube")
     pool.close()
     await pool.wait_closed()
 
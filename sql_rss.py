@@ -2,15 +2,16 @@ import asyncio
 import aiohttp
 import aiomysql
 import logging
-import re
 import os
 from dotenv import load_dotenv
-from feedparser import parse
+from feed_state import FeedState, fetch_if_changed
+from mysql_store import SentEntryBuffer, SentEntryIndex, ensure_dedup_schema, prune_sent_entries
+from parse_pool import parse_feed
+from sanitizers import strip_markdown
 from telegram import Bot
-from tencentcloud.common import credential
-from tencentcloud.common.profile.client_profile import ClientProfile
-from tencentcloud.common.profile.http_profile import HttpProfile
-from tencentcloud.tmt.v20180321 import tmt_client, models
+from telegram_sender import send_queue
+from message_chunker import split_message
+from translator import TencentTranslator
 
 # 加载.env 文件
 load_dotenv()
@@ -73,36 +74,31 @@ DB_CONFIG = {
     'maxsize': 10
 }
 
+# 条件请求缓存（ETag / Last-Modified / 内容哈希）
+feed_state = FeedState("sql_rss_feed_state.json")
+
 TENCENTCLOUD_SECRET_ID = os.getenv("TENCENTCLOUD_SECRET_ID")
 TENCENTCLOUD_SECRET_KEY = os.getenv("TENCENTCLOUD_SECRET_KEY")
 
-def sanitize_markdown(text):
-    # 首先去除 HTML 标签
-    text = re.sub(r'<[^>]*>', '', text)
-    # 然后去除 Telegram 不支持的 Markdown 符号
-    text = re.sub(r'[*_`|#\\[\\](){}<>]', '', text)
-    return text
+# 全局复用的翻译客户端（线程池 + QPS 限制）
+translator = TencentTranslator(TENCENTCLOUD_SECRET_ID, TENCENTCLOUD_SECRET_KEY)
+
+def entry_key(entry):
+    """去重键：(链接, 标题, 标题_链接)"""
+    subject = entry.title or "*无标题*"
+    url = entry.link
+    return url, subject, f"{subject}_{url}"
 
 async def send_single_message(bot, chat_id, text, disable_web_page_preview=False):
     try:
-        # Telegram 最大消息字节数限制：4096字节
-        MAX_MESSAGE_LENGTH = 4096
-        # 计算消息的字节数
-        if len(text.encode('utf-8')) > MAX_MESSAGE_LENGTH:
-            # 如果超长，拆分为多个消息
-            for i in range(0, len(text), MAX_MESSAGE_LENGTH):
-                await bot.send_message(
-                    chat_id=chat_id, 
-                    text=text[i:i+MAX_MESSAGE_LENGTH], 
-                    parse_mode='Markdown', 
-                    disable_web_page_preview=disable_web_page_preview
-                )
-        else:
-            # 如果没有超长，直接发送
-            await bot.send_message(
-                chat_id=chat_id, 
-                text=text, 
-                parse_mode='Markdown', 
+        # 按 UTF-16 长度切分，且不会拆开 Markdown 链接、加粗等实体
+        for chunk in split_message(text, parse_mode='Markdown'):
+            # 限速与 429 重试由发送调度统一处理
+            await send_queue.send_message(
+                bot,
+                chat_id,
+                chunk,
+                parse_mode='Markdown',
                 disable_web_page_preview=disable_web_page_preview
             )
     except Exception as e:
@@ -113,40 +109,32 @@ async def fetch_feed(session, feed_url):
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36'
     }
     try:
-        async with session.get(feed_url, headers=headers, timeout=40) as response:
-            response.raise_for_status()
-            content = await response.read()
-            return parse(content)
+        content = await fetch_if_changed(session, feed_url, feed_state, headers=headers, timeout=40)
+        if content is None:
+            return None
+        return await parse_feed(content)
     except Exception as e:
         logging.error(f"Error fetching {feed_url}: {e}")
         return None
 
-async def auto_translate_text(text):
+async def auto_translate_texts(texts):
+    """批量翻译，失败时返回原文"""
     try:
-        cred = credential.Credential(TENCENTCLOUD_SECRET_ID, TENCENTCLOUD_SECRET_KEY)
-        httpProfile = HttpProfile(endpoint="tmt.tencentcloudapi.com")
-        clientProfile = ClientProfile(httpProfile=httpProfile)
-        client = tmt_client.TmtClient(cred, "na-siliconvalley", clientProfile)
-
-        req = models.TextTranslateRequest()
-        req.SourceText = text
-        req.Source = "auto"
-        req.Target = "zh"
-        req.ProjectId = 0
-
-        resp = client.TextTranslate(req)
-        return resp.TargetText
+        return await translator.translate_batch(texts)
     except Exception as e:
-        logging.error(f"Translation error for text '{text}': {e}")
-        return text
+        logging.error(f"Translation error for {len(texts)} texts: {e}")
+        return list(texts)
 # 主题+翻意内容+预览
-async def process_feed(session, feed_url, sent_entries, pool, bot, table_name, translate=True):
+async def process_feed(session, feed_url, sent_entries, writer, bot, translate=True):
     feed_data = await fetch_feed(session, feed_url)
     if feed_data is None:
         return []
 
     source_name = feed_data.feed.get('title', feed_url)  # 动态获取源名称
     new_entries = []
+    pending = []
+    # 只向数据库查询本次抓取到的条目
+    await sent_entries.prefetch(entry_key(entry) for entry in feed_data.entries)
 
     for entry in feed_data.entries:
         subject = entry.title or "*无标题*"
@@ -155,40 +143,51 @@ async def process_feed(session, feed_url, sent_entries, pool, bot, table_name, t
         message_id = f"{subject}_{url}"
 
         if (url, subject, message_id) not in sent_entries:
-            if translate:
-                translated_subject = await auto_translate_text(subject)
-                translated_summary = await auto_translate_text(summary)
-            else:
-                translated_subject = subject
-                translated_summary = summary
+            pending.append((url, subject, summary, message_id))
+
+    if not pending:
+        feed_state.commit(feed_url)
+        return []
+
+    # 整个源的标题和简介合并为一次批量翻译
+    texts = [text for _, subject, summary, _ in pending for text in (subject, summary)]
+    translated = await auto_translate_texts(texts) if translate else texts
+
+    for i, (url, subject, summary, message_id) in enumerate(pending):
+        # 翻译期间其他任务可能已发送同一条目
+        if (url, subject, message_id) not in sent_entries:
+            translated_subject = translated[2 * i]
+            translated_summary = translated[2 * i + 1]
 
-            cleaned_subject = sanitize_markdown(translated_subject)
+            cleaned_subject = strip_markdown(translated_subject)
             message = f"*{cleaned_subject}*\n{translated_summary}\n[{source_name}]({url})"
             await send_single_message(bot, TELEGRAM_CHAT_ID[0], message)
 
             new_entries.append((url, subject, message_id))
-            await save_sent_entry_to_db(pool, url, subject, message_id, table_name)
+            await writer.add(url, subject, message_id)
             sent_entries.add((url, subject, message_id))
 
+    feed_state.commit(feed_url)
     return new_entries
 # 主题+内容 超过333字节不发送
-async def process_third_feed(session, feed_url, sent_entries, pool, bot, table_name):
+async def process_third_feed(session, feed_url, sent_entries, writer, bot):
     feed_data = await fetch_feed(session, feed_url)
     if feed_data is None:
         return []
 
     source_name = feed_data.feed.get('title', feed_url)  # 动态获取源名称
     merged_message = ""
+    await sent_entries.prefetch(entry_key(entry) for entry in feed_data.entries)
 
     for entry in feed_data.entries:
         subject = entry.title or "*无标题*"
         url = entry.link
         summary = getattr(entry, 'summary', "暂无简介")
-        summary = sanitize_markdown(summary)
+        summary = strip_markdown(summary)
         message_id = f"{subject}_{url}"
 
         if (url, subject, message_id) not in sent_entries:
-            cleaned_subject = sanitize_markdown(subject)
+            cleaned_subject = strip_markdown(subject)
 
             # 检查主题和内容的字节长度
             total_length = len(cleaned_subject.encode('utf-8')) + len(summary.encode('utf-8'))
@@ -199,22 +198,24 @@ async def process_third_feed(session, feed_url, sent_entries, pool, bot, table_n
                 # 如果字节长度不超过 333 字节，则合并发送
                 merged_message += f"*{cleaned_subject}*\n{summary}\n[{source_name}]({url})\n\n"
                 sent_entries.add((url, subject, message_id))
-                await save_sent_entry_to_db(pool, url, subject, message_id, table_name)
+                await writer.add(url, subject, message_id)
 
     if merged_message:
         # 发送合并后的消息
         await send_single_message(bot, TELEGRAM_CHAT_ID[0], merged_message, disable_web_page_preview=True)
 
+    feed_state.commit(feed_url)
     return []
 
 # 主题+预览
-async def process_fourth_feed(session, feed_url, sent_entries, pool, bot, table_name):
+async def process_fourth_feed(session, feed_url, sent_entries, writer, bot):
     feed_data = await fetch_feed(session, feed_url)
     if feed_data is None:
         return []
 
     source_name = feed_data.feed.get('title', feed_url)  # 动态获取源名称
     merged_message = ""
+    await sent_entries.prefetch(entry_key(entry) for entry in feed_data.entries)
 
     for entry in feed_data.entries:
         subject = entry.title or "*无标题*"
@@ -222,15 +223,16 @@ async def process_fourth_feed(session, feed_url, sent_entries, pool, bot, table_
         message_id = f"{subject}_{url}"
 
         if (url, subject, message_id) not in sent_entries:
-            cleaned_subject = sanitize_markdown(subject)
+            cleaned_subject = strip_markdown(subject)
             merged_message += f"{source_name}\n*{cleaned_subject}*\n{url}\n\n"
 
             sent_entries.add((url, subject, message_id))
-            await save_sent_entry_to_db(pool, url, subject, message_id, table_name)
+            await writer.add(url, subject, message_id)
 
     if merged_message:
         await send_single_message(bot, TELEGRAM_CHAT_ID[0], merged_message, disable_web_page_preview=False)
 
+    feed_state.commit(feed_url)
     return []
 
 async def connect_to_db_pool():
@@ -240,29 +242,6 @@ async def connect_to_db_pool():
         logging.error(f"Database connection error: {e}")
         return None
 
-async def load_sent_entries_from_db(pool, table_name):
-    try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(f"SELECT url, subject, message_id FROM {table_name}")
-                rows = await cursor.fetchall()
-                return {(row[0], row[1], row[2]) for row in rows}
-    except Exception as e:
-        logging.error(f"Error loading sent entries: {e}")
-        return set()
-
-async def save_sent_entry_to_db(pool, url, subject, message_id, table_name):
-    try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    f"INSERT IGNORE INTO {table_name} (url, subject, message_id) VALUES (%s, %s, %s)",
-                    (url, subject, message_id)
-                )
-                await conn.commit()
-    except Exception as e:
-        logging.error(f"Error saving entry: {e}")
-
 async def main():
     pool = await connect_to_db_pool()
     if not pool:
@@ -270,28 +249,45 @@ async def main():
         return
 
     async with pool:
-        sent_entries = await load_sent_entries_from_db(pool, "sent_rss")
-        sent_entries_third = await load_sent_entries_from_db(pool, "sent_rss2")
-        sent_entries_fourth = await load_sent_entries_from_db(pool, "sent_rss")
-
-        async with aiohttp.ClientSession() as session:
-            bot = Bot(token=TELEGRAM_BOT_TOKEN)
-            third_bot = Bot(token=RSS_TWO)
-            fourth_bot = Bot(token=RSS_HAOYAN)
-
-            tasks = [
-                process_feed(session, feed_url, sent_entries, pool, bot, "sent_rss", translate=True)
-                for feed_url in RSS_FEEDS
-            ] + [
-                process_third_feed(session, feed_url, sent_entries_third, pool, third_bot, "sent_rss2")
-                for feed_url in THIRD_RSS_FEEDS
-            ] + [
-                process_fourth_feed(session, feed_url, sent_entries_fourth, pool, fourth_bot, "sent_rss")
-                for feed_url in FOURTH_RSS_FEEDS
-            ]
-
-            await asyncio.gather(*tasks)
-
+        # 不再整表加载已发送记录，按本次抓取到的条目哈希查询
+        hashed = await ensure_dedup_schema(pool, "sent_rss")
+        hashed_third = await ensure_dedup_schema(pool, "sent_rss2")
+        sent_entries = SentEntryIndex(pool, "sent_rss", hashed)
+        sent_entries_third = SentEntryIndex(pool, "sent_rss2", hashed_third)
+        sent_entries_fourth = SentEntryIndex(pool, "sent_rss", hashed)
+
+        # 写缓冲：按批次合并写库，每张表一个
+        writer = SentEntryBuffer(pool, "sent_rss", hashed)
+        third_writer = SentEntryBuffer(pool, "sent_rss2", hashed_third)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                bot = Bot(token=TELEGRAM_BOT_TOKEN)
+                third_bot = Bot(token=RSS_TWO)
+                fourth_bot = Bot(token=RSS_HAOYAN)
+
+                tasks = [
+                    process_feed(session, feed_url, sent_entries, writer, bot, translate=True)
+                    for feed_url in RSS_FEEDS
+                ] + [
+                    process_third_feed(session, feed_url, sent_entries_third, third_writer, third_bot)
+                    for feed_url in THIRD_RSS_FEEDS
+                ] + [
+                    process_fourth_feed(session, feed_url, sent_entries_fourth, writer, fourth_bot)
+                    for feed_url in FOURTH_RSS_FEEDS
+                ]
+
+                await asyncio.gather(*tasks)
+        finally:
+            await writer.close()
+            await third_writer.close()
+            translator.close()
+
+        if hashed:
+            await prune_sent_entries(pool, "sent_rss")
+        if hashed_third:
+            await prune_sent_entries(pool, "sent_rss2")
+        feed_state.save()
         pool.close()
         await pool.wait_closed()
 
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import time
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+# Telegram 官方限制：单个 bot 约 30 条/秒，同一私聊约 1 条/秒，同一群组 20 条/分钟（频道按私聊计算）
+BOT_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_BOT_RATE", "30"))
+CHAT_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+GROUP_MESSAGES_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))
+SEND_MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """异步令牌桶，等待者按先来后到获得令牌"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """服务端返回 retry_after 时暂停发放令牌"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TelegramSendQueue:
+    """进程内所有 bot 共享的 Telegram 发送调度
+
+    每个 bot 一个令牌桶，每个 (bot, chat) 一个令牌桶，群组和超级群组按每分钟限额计算，
+    私聊和频道按每秒限额计算。遇到 429 时按服务端给出的 retry_after 暂停该会话，
+    网络超时按指数退避重试；BadRequest 等不可重试的错误直接抛出给调用方。
+    """
+
+    def __init__(self):
+        self.bot_buckets = {}
+        self.chat_buckets = {}
+
+    def _bot_bucket(self, bot):
+        key = bot.token
+        if key not in self.bot_buckets:
+            self.bot_buckets[key] = TokenBucket(BOT_MESSAGES_PER_SECOND, capacity=BOT_MESSAGES_PER_SECOND)
+        return self.bot_buckets[key]
+
+    @staticmethod
+    async def _is_group(bot, chat_id):
+        """普通群组的 chat_id 为负数；-100 开头（或 @用户名）的可能是超级群组也可能是频道，
+        只能查询一次会话类型。查询失败时按群组限额，宁可慢一些也不触发限流"""
+        chat = str(chat_id)
+        if not chat.startswith(('-100', '@')):
+            return chat.startswith('-')
+        try:
+            return (await bot.get_chat(chat_id)).type != 'channel'
+        except Exception as e:
+            logging.warning(f"Could not look up chat type of {chat_id}, using group rate limit: {e}")
+            return True
+
+    async def _chat_bucket(self, bot, chat_id):
+        key = (bot.token, str(chat_id))
+        if key not in self.chat_buckets:
+            if await self._is_group(bot, chat_id):
+                bucket = TokenBucket(GROUP_MESSAGES_PER_MINUTE / 60)
+            else:
+                bucket = TokenBucket(CHAT_MESSAGES_PER_SECOND)
+            # 同一会话的首批消息可能并发查询，只保留第一个令牌桶
+            self.chat_buckets.setdefault(key, bucket)
+        return self.chat_buckets[key]
+
+    async def send_message(self, bot, chat_id, text, max_retries=SEND_MAX_RETRIES, **kwargs):
+        chat_bucket = await self._chat_bucket(bot, chat_id)
+        bot_bucket = self._bot_bucket(bot)
+        attempt = 0
+        while True:
+            await chat_bucket.acquire()
+            await bot_bucket.acquire()
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logging.warning(f"Flood control for chat {chat_id}, retrying in {delay} seconds")
+                chat_bucket.pause(delay)
+                if attempt >= max_retries:
+                    raise
+            except BadRequest:
+                raise
+            except NetworkError as e:
+                if attempt >= max_retries:
+                    raise
+                logging.warning(f"Send attempt {attempt + 1} to chat {chat_id} failed: {e}")
+                await asyncio.sleep(2 ** attempt)
+            attempt += 1
+
+
+# 进程内共享的发送调度
+send_queue = TelegramSendQueue()
@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tencentcloud.common import credential
+from tencentcloud.common.profile.client_profile import ClientProfile
+from tencentcloud.common.profile.http_profile import HttpProfile
+from tencentcloud.tmt.v20180321 import tmt_client, models
+
+TRANSLATE_ENDPOINT = "tmt.tencentcloudapi.com"
+TRANSLATE_REGION = "na-siliconvalley"
+TRANSLATE_MAX_WORKERS = int(os.getenv("TRANSLATE_MAX_WORKERS", "4"))  # 翻译线程池大小
+TRANSLATE_QPS = float(os.getenv("TRANSLATE_QPS", "5"))  # 腾讯云机器翻译默认 5 次/秒
+TRANSLATE_BATCH_MAX_CHARS = 5000  # TextTranslateBatch 单次请求文本总长度需低于 6000 字符
+TRANSLATE_BATCH_MAX_ITEMS = 50
+TRANSLATE_CACHE_FILE = os.getenv("TRANSLATE_CACHE_FILE", "translate_cache.db")  # 置空则禁用缓存
+TRANSLATE_CACHE_TTL_DAYS = 30  # 缓存条目最长保留天数
+TRANSLATE_CACHE_MAX_ENTRIES = 20000  # 超出后按最近使用时间淘汰
+
+
+class RateLimiter:
+    """按固定间隔发放调用许可，限制每秒请求数（rate <= 0 表示不限速）"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self.next_time)
+        self.next_time = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class TranslationCache:
+    """磁盘翻译缓存（SQLite）
+
+    以 源语言/目标语言/原文 的哈希为键，按 TTL 过期并在超出容量时淘汰
+    最久未使用的条目，同时统计本次运行的命中率。
+    """
+
+    def __init__(self, file_path, ttl_days=TRANSLATE_CACHE_TTL_DAYS, max_entries=TRANSLATE_CACHE_MAX_ENTRIES):
+        self.file_path = file_path
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(file_path, timeout=10)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON translations (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(text, source, target):
+        return hashlib.sha256(f"{source}\0{target}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts, source, target):
+        """返回 {原文: 译文}，只包含命中且未过期的条目"""
+        keys = {self.make_key(text, source, target): text for text in texts}
+        now = time.time()
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):  # SQLite 单条语句参数个数有上限
+            chunk = key_list[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, translation FROM translations WHERE key IN ({placeholders}) AND created >= ?",
+                (*chunk, now - self.ttl)
+            ).fetchall()
+            for key, translation in rows:
+                found[keys[key]] = translation
+        if found:
+            self.conn.executemany(
+                "UPDATE translations SET last_used = ? WHERE key = ?",
+                [(now, self.make_key(text, source, target)) for text in found]
+            )
+            self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, pairs, source, target):
+        if not pairs:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO translations (key, translation, created, last_used) VALUES (?, ?, ?, ?)",
+            [(self.make_key(text, source, target), translation, now, now) for text, translation in pairs.items()]
+        )
+        self.conn.commit()
+
+    def evict(self):
+        self.conn.execute("DELETE FROM translations WHERE created < ?", (time.time() - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM translations WHERE key IN ("
+            "SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.conn.commit()
+
+    def close(self):
+        total = self.hits + self.misses
+        if total:
+            logging.info(
+                f"Translation cache: {self.hits} hits, {self.misses} misses "
+                f"({self.hits / total:.1%} hit rate)"
+            )
+        try:
+            self.evict()
+        finally:
+            self.conn.close()
+
+
+class TencentTranslator:
+    """长期复用的腾讯云机器翻译客户端
+
+    只创建一次 TmtClient，阻塞的 SDK 调用放到有界线程池中执行，
+    不再卡住事件循环；所有调用共享同一个 QPS 限制。
+    """
+
+    def __init__(self, secret_id, secret_key, region=TRANSLATE_REGION,
+                 max_workers=TRANSLATE_MAX_WORKERS, qps=TRANSLATE_QPS, cache_file=TRANSLATE_CACHE_FILE):
+        self.secret_id = secret_id
+        self.secret_key = secret_key
+        self.region = region
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(qps)
+        self.client = None
+        self.executor = None
+        self.cache_file = cache_file
+        self.cache = None
+
+    def _get_cache(self):
+        if self.cache is None and self.cache_file:
+            try:
+                self.cache = TranslationCache(self.cache_file)
+            except Exception as e:
+                logging.error(f"Error opening translation cache {self.cache_file}: {e}")
+                self.cache_file = None
+        return self.cache
+
+    def _cache_lookup(self, texts, source, target):
+        cache = self._get_cache()
+        if cache is None:
+            return {}
+        try:
+            return cache.get_many(texts, source, target)
+        except Exception as e:
+            logging.error(f"Translation cache lookup error: {e}")
+            return {}
+
+    def _cache_store(self, pairs, source, target):
+        cache = self._get_cache()
+        if cache is None:
+            return
+        try:
+            cache.put_many(pairs, source, target)
+        except Exception as e:
+            logging.error(f"Translation cache store error: {e}")
+
+    def _ensure_client(self):
+        # 延迟到第一次翻译时才创建，未配置密钥且无需翻译时脚本仍可运行
+        if self.client is None:
+            cred = credential.Credential(self.secret_id, self.secret_key)
+            http_profile = HttpProfile(endpoint=TRANSLATE_ENDPOINT)
+            client_profile = ClientProfile(httpProfile=http_profile)
+            self.client = tmt_client.TmtClient(cred, self.region, client_profile)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tmt')
+
+    def _text_translate(self, text, source, target):
+        req = models.TextTranslateRequest()
+        req.SourceText = text
+        req.Source = source
+        req.Target = target
+        req.ProjectId = 0
+        return self.client.TextTranslate(req).TargetText
+
+    def _text_translate_batch(self, texts, source, target):
+        req = models.TextTranslateBatchRequest()
+        req.SourceTextList = texts
+        req.Source = source
+        req.Target = target
+        req.ProjectId = 0
+        return self.client.TextTranslateBatch(req).TargetTextList
+
+    async def translate(self, text, target="zh", source="auto"):
+        """翻译单条文本，优先查缓存；失败时抛出异常由调用方处理"""
+        cached = self._cache_lookup([text], source, target)
+        if text in cached:
+            return cached[text]
+        result = await self._request_translate(text, source, target)
+        self._cache_store({text: result}, source, target)
+        return result
+
+    async def _request_translate(self, text, source, target):
+        self._ensure_client()
+        await self.limiter.acquire()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._text_translate, text, source, target)
+
+    async def translate_batch(self, texts, target="zh", source="auto"):
+        """批量翻译，结果与输入一一对应；翻译失败的文本原样返回
+
+        相同文本只翻译一次，缓存未命中的部分按长度和条数分组后通过
+        TextTranslateBatch 发送。
+        """
+        unique = list(dict.fromkeys(text for text in texts if text and text.strip()))
+        if not unique:
+            return list(texts)
+
+        translated = self._cache_lookup(unique, source, target)
+        missing = [text for text in unique if text not in translated]
+        if missing:
+            self._ensure_client()
+            groups = split_batches(missing)
+            results = await asyncio.gather(
+                *(self._translate_group(group, source, target) for group in groups)
+            )
+            fresh = {}
+            for group, targets in zip(groups, results):
+                fresh.update((text, target_text) for text, target_text in zip(group, targets) if target_text is not None)
+            self._cache_store(fresh, source, target)
+            translated.update(fresh)
+        return [translated.get(text, text) for text in texts]
+
+    async def _translate_group(self, group, source, target):
+        await self.limiter.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            targets = await loop.run_in_executor(
+                self.executor, self._text_translate_batch, group, source, target
+            )
+            if len(targets) == len(group):
+                return targets
+            logging.error(f"Batch translation returned {len(targets)} results for {len(group)} texts")
+        except Exception as e:
+            logging.error(f"Batch translation error ({len(group)} texts): {e}")
+
+        # 整批失败时逐条重试，单条仍失败返回 None（调用方保留原文且不写入缓存）
+        async def translate_one(text):
+            try:
+                return await self._request_translate(text, source, target)
+            except Exception as e:
+                logging.error(f"Translation error for text '{text}': {e}")
+                return None
+
+        return await asyncio.gather(*(translate_one(text) for text in group))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.cache is not None:
+            try:
+                self.cache.close()
+            except Exception as e:
+                logging.error(f"Error closing translation cache: {e}")
+            self.cache = None
+
+
+def split_batches(texts, max_chars=TRANSLATE_BATCH_MAX_CHARS, max_items=TRANSLATE_BATCH_MAX_ITEMS):
+    """按总字符数和条数上限把文本分组"""
+    groups = []
+    current = []
+    current_chars = 0
+    for text in texts:
+        if current and (current_chars + len(text) > max_chars or len(current) >= max_items):
+            groups.append(current)
+            current = []
+            current_chars = 0
+        current.append(text)
+        current_chars += len(text)
+    if current:
+        groups.append(current)
+    return groups